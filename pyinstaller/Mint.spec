@@ -14,8 +14,6 @@ all_hidden_imports = (
     collect_submodules('ms_mint_app')  # Our own package - always include
     + [
         # Add specific hidden imports only if needed
-        'bs4',
-        'bs4.builder._htmlparser',
         'packaging',
         'packaging.version',
         'packaging.specifiers',
@@ -249,7 +249,9 @@ def register_callbacks(app, cache, fsc):
             return dbc.Alert("Please import MS files.", color="warning")
         elif tab in ["Processing"] and (len(T.get_targets(wdir)) == 0):
             return dbc.Alert("Please, define targets.", color="warning")
-        elif tab in ["Analysis"] and not P(T.get_results_fn(wdir)).is_file():
+        elif tab in ["Analysis"] and not (
+            P(T.get_results_fn(wdir)).is_file() or P(T.get_results_csv_fn(wdir)).is_file()
+        ):
             return dbc.Alert("Please, create results (Processing).", color="warning")
         if func is not None:
             return func()
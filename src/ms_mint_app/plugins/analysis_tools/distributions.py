@@ -109,6 +109,7 @@ def callbacks(app, fsc, cache):
 
         mint = Mint()
         mint.results = df[MINT_RESULTS_COLUMNS]
+        T.compact_metadata(wdir)
         mint.load_metadata(T.get_metadata_fn(wdir))
 
         df = mint.crosstab(var_name=var_name, index=['ms_file_label', colorby], 
@@ -102,6 +102,7 @@ def callbacks(app, fsc, cache):
             return "No results yet. First run MINT."
 
         mint.results = df[MINT_RESULTS_COLUMNS]
+        T.compact_metadata(wdir)
         mint.load_metadata(T.get_metadata_fn(wdir))
         
         df = mint.crosstab(var_name=var_name, apply=apply, groupby=groupby, scaler=scaler)
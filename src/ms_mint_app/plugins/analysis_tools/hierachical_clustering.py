@@ -134,6 +134,7 @@ def callbacks(app, fsc, cache):
         )
     
         mint.results = df[MINT_RESULTS_COLUMNS]
+        T.compact_metadata(wdir)
         mint.load_metadata(T.get_metadata_fn(wdir))
 
         fig = mint.plot.hierarchical_clustering(
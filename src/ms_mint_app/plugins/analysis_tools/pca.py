@@ -123,6 +123,7 @@ def callbacks(app, fsc, cache):
         figures = []
         mint = Mint()
         mint.results = df[MINT_RESULTS_COLUMNS]
+        T.compact_metadata(wdir)
         mint.load_metadata(T.get_metadata_fn(wdir))
 
         n_peak_labels = len(mint.results.peak_label.drop_duplicates())
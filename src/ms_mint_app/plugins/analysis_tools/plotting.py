@@ -409,6 +409,7 @@ def callbacks(app, fsc, cache, cpu=None):
 
         mint = Mint()
         mint.results = df[MINT_RESULTS_COLUMNS]
+        T.compact_metadata(wdir)
         mint.load_metadata(T.get_metadata_fn(wdir))
 
         df_2 = mint.crosstab(var_name=var_name, apply=apply, groupby=groupby, scaler=scaler)
@@ -1,6 +1,3 @@
-import pandas as pd
-
-import dash
 from dash import html, dcc
 import dash_bootstrap_components as dbc
 from dash_extensions.javascript import Namespace
@@ -225,7 +222,6 @@ def callbacks(app, fsc, cache):
         Output({"index": "meta-apply-output", "type": "output"}, "children"),
         Output("meta-apply-output", "children"),
         Input("meta-apply", "n_clicks"),
-        State("meta-table", "data"),
         State("meta-table", "multiRowsClicked"),
         State("meta-table", "dataFiltered"),
         State("meta-action", "value"),
@@ -236,7 +232,6 @@ def callbacks(app, fsc, cache):
     )
     def meta_apply(
         n_clicks,
-        data,
         selected_rows,
         data_filtered,
         action,
@@ -246,41 +241,41 @@ def callbacks(app, fsc, cache):
         wdir,
     ):
         """
-        This callback saves applies the column actions and
-        saves the table to the harddrive.
+        This callback applies the column actions and
+        saves the changes to the harddrive.
         """
-        if (n_clicks is None) or (data is None) or (len(data) == 0):
+        if n_clicks is None:
+            raise PreventUpdate
+        # Only setting values depends on the rows shown in the table
+        if action == "Set" and data_filtered is None:
             raise PreventUpdate
         if action == "Set" and column == "PeakOpt":
             value = value_bool
-        df = pd.DataFrame(data)
-        if "index" in df.columns:
-            df = df.set_index("index")
-        else:
-            df = df.reset_index()
-        prop_id = dash.callback_context.triggered[0]["prop_id"]
-        if prop_id == "meta-apply.n_clicks":
-            if action == "Set":
-                filtered_rows = [r for r in data_filtered["rows"] if r is not None]
-                filtered_ndx = [r["index"] for r in filtered_rows]
-                if selected_rows == []:
-                    # If nothing is selected apply to all visible rows
-                    ndxs = filtered_ndx
-                else:
-                    # If something is selected only apply to selected rows
-                    ndxs = [
-                        r["index"] for r in selected_rows if r["index"] in filtered_ndx
-                    ]
-                if len(ndxs) == 0 or column is None:
-                    # If no column is selected just save the table.
-                    T.write_metadata(df, wdir)
-                    return dbc.Alert("Metadata saved.", color="info"), "Applied"
-                df.loc[ndxs, column] = value
-            elif action == "create_column":
-                df[value] = ""
-            elif action == "delete_column":
-                del df[column]
-        T.write_metadata(df, wdir)
+        changes = []
+        if action == "Set":
+            filtered_rows = [r for r in data_filtered["rows"] if r is not None]
+            filtered_labels = [r["ms_file_label"] for r in filtered_rows]
+            if selected_rows == []:
+                # If nothing is selected apply to all visible rows
+                labels = filtered_labels
+            else:
+                # If something is selected only apply to selected rows
+                labels = [
+                    r["ms_file_label"] for r in selected_rows
+                    if r["ms_file_label"] in filtered_labels
+                ]
+            if column is not None:
+                changes = [
+                    {"op": "set", "ms_file_label": label, "column": column, "value": value}
+                    for label in labels
+                ]
+        elif action == "create_column":
+            changes = [{"op": "create_column", "column": value}]
+        elif action == "delete_column":
+            changes = [{"op": "delete_column", "column": column}]
+        # Cell edits are saved as they happen, nothing else to save
+        if len(changes) > 0:
+            T.update_metadata(wdir, changes)
         return dbc.Alert("Metadata saved.", color="info"), "Applied"
 
     @app.callback(
@@ -288,18 +283,26 @@ def callbacks(app, fsc, cache):
             {"index": "meta-table-saved-on-edit-output", "type": "output"}, "children"
         ),
         Input("meta-table", "cellEdited"),
-        State("meta-table", "data"),
         State("wdir", "children"),
     )
-    def save_table_on_edit(cell_edited, data, wdir):
+    def save_table_on_edit(cell_edited, wdir):
         """
-        This callback saves the table on cell edits.
-        This saves some bandwidth.
+        This callback saves the edited cell on cell edits.
+        Only the edit is sent and stored, not the complete table.
         """
-        if data is None or cell_edited is None:
+        if cell_edited is None:
             raise PreventUpdate
-        df = pd.DataFrame(data)
-        T.write_metadata(df, wdir)
+        T.update_metadata(
+            wdir,
+            [
+                {
+                    "op": "set",
+                    "ms_file_label": cell_edited["row"]["ms_file_label"],
+                    "column": cell_edited["column"],
+                    "value": cell_edited["value"],
+                }
+            ],
+        )
         return dbc.Alert("Metadata saved.", color="info")
 
     @app.callback(
@@ -9,14 +9,12 @@ from pathlib import Path as P
 
 import pandas as pd
 
-from dash import html, dcc
+from dash import html, dcc, no_update
 from dash.exceptions import PreventUpdate
 from dash.dependencies import Input, Output, State
 
 import dash_bootstrap_components as dbc
 
-from ms_mint.io import convert_ms_file_to_feather
-
 from dash_tabulator import DashTabulator
 
 import dash_uploader as du
@@ -87,6 +85,30 @@ columns = [
         "sorter": "string",
         "frozen": True,
     },
+    {
+        "title": "n_scans",
+        "field": "n_scans",
+        "headerFilter": True,
+        "headerSort": True,
+        "editor": None,
+        "sorter": "number",
+    },
+    {
+        "title": "scan_time_range",
+        "field": "scan_time_range",
+        "headerFilter": True,
+        "headerSort": True,
+        "editor": None,
+        "sorter": "string",
+    },
+    {
+        "title": "polarity",
+        "field": "polarity",
+        "headerFilter": True,
+        "headerSort": True,
+        "editor": None,
+        "sorter": "string",
+    },
     {
         "title": "",
         "field": "",
@@ -134,12 +156,38 @@ _layout = html.Div(
                 "display": "inline-block",
             },
         ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    dcc.Input(
+                        id="ms-import-from-url-input",
+                        placeholder="URL of a HTTP or FTP directory with MS files",
+                        style={"width": "100%"},
+                    ),
+                ),
+                dbc.Col(
+                    dbc.Button("Import from URL", id="ms-import-from-url"),
+                    width="auto",
+                ),
+            ],
+            style={"marginBottom": "20px"},
+        ),
         dcc.Markdown("##### Actions"),
         dbc.Row(
             [
                 dbc.Col(
                     [
                         dbc.Button("Convert selected files to Feather", id="ms-convert"),
+                        dcc.Checklist(
+                            id="ms-convert-options",
+                            options=[
+                                {
+                                    "label": " Add m/z sorted copy (faster chromatograms, more disk space)",
+                                    "value": "mz_sorted",
+                                }
+                            ],
+                            value=[],
+                        ),
                         # dbc.Button("Convert selected files to Parquet", id="ms-convert-parquet"),
                     ]
                 ),
@@ -152,6 +200,8 @@ _layout = html.Div(
         ),
         dcc.Loading(ms_table),
         html.Div(id="ms-n-files", style={"max-width": "300px"}),
+        html.Div(id="ms-queue-status"),
+        html.Div(0, id="ms-queue-n-pending", style={"visibility": "hidden"}),
         html.Div(id="ms-uploader-fns", style={"visibility": "hidden"}),
     ]
 )
@@ -182,19 +232,25 @@ def callbacks(app, fsc, cache):
         Input("wdir", "children"),
         Input({"index": "ms-delete-output", "type": "output"}, "children"),
         Input({"index": "ms-convert-output", "type": "output"}, "children"),
+        Input({"index": "ms-import-from-url-output", "type": "output"}, "children"),
+        Input("ms-queue-n-pending", "children"),
         State("active-workspace", "children"),
     )
-    def ms_table(value, wdir, files_deleted, files_converted, workspace):
+    def ms_table(value, wdir, files_deleted, files_converted, files_imported, n_pending, workspace):
+
+        catalog = T.get_ms_catalog(wdir)
+        logging.info(f'# Files in {wdir} {workspace} {len(catalog)}')
 
-        ms_files = T.get_ms_fns(wdir)
-        logging.info(f'# Files in {wdir} {workspace} {len(ms_files)}')
-        
         data = pd.DataFrame(
             {
-                "ms_file": [os.path.basename(fn) for fn in ms_files],
-                "file_size": [
-                    np.round(os.path.getsize(fn) / 1024 / 1024, 2) for fn in ms_files
+                "ms_file": catalog.ms_file,
+                "file_size": np.round(catalog.file_size / 1024 / 1024, 2),
+                "n_scans": catalog.n_scans,
+                "scan_time_range": [
+                    f"{t_min:.1f}-{t_max:.1f}" if pd.notna(t_min) else ""
+                    for t_min, t_max in zip(catalog.scan_time_min, catalog.scan_time_max)
                 ],
+                "polarity": catalog.polarities.fillna(""),
             }
         )
 
@@ -211,23 +267,57 @@ def callbacks(app, fsc, cache):
         Output({"index": "ms-convert-output", "type": "output"}, "children"),
         Input("ms-convert", "n_clicks"),
         State("ms-table", "multiRowsClicked"),
+        State("ms-convert-options", "value"),
         State("wdir", "children"),
     )
-    def ms_convert(n_clicks, rows, wdir):
+    def ms_convert(n_clicks, rows, options, wdir):
         target_dir = os.path.join(wdir, "ms_files")
         if n_clicks is None:
             raise PreventUpdate
+        mz_sorted = options is not None and "mz_sorted" in options
         fns = [row["ms_file"] for row in rows]
-        fns = [fn for fn in fns if not fn.endswith(".feather")]
+        if not mz_sorted:
+            fns = [fn for fn in fns if not fn.endswith(".feather")]
         fns = [os.path.join(target_dir, fn) for fn in fns]
-        n_total = len(fns)
-        for i, fn in enumerate(fns):
-            fsc.set("progress", int(100 * (i + 1) / n_total))
-            new_fn = convert_ms_file_to_feather(fn)
-            if os.path.isfile(new_fn):
+        converted, errors = T.convert_ms_files(
+            fns,
+            mz_sorted=mz_sorted,
+            progress_callback=lambda progress: fsc.set("progress", progress),
+        )
+        for fn, new_fn in converted.items():
+            if os.path.isfile(new_fn) and new_fn != fn:
                 os.remove(fn)
+        T.update_ms_catalog(wdir, [fn for fn in converted.values() if os.path.isfile(fn)])
+        if len(errors) > 0:
+            return dbc.Alert(
+                [html.P(f"{len(errors)} of {len(fns)} files could not be converted:")]
+                + [html.P(f"{os.path.basename(fn)}: {error}") for fn, error in errors.items()],
+                color="warning",
+            )
         return dbc.Alert("Files converted to feather format.", color="info")
 
+    @app.callback(
+        Output({"index": "ms-import-from-url-output", "type": "output"}, "children"),
+        Input("ms-import-from-url", "n_clicks"),
+        State("ms-import-from-url-input", "value"),
+        State("wdir", "children"),
+    )
+    def ms_import_from_url(n_clicks, url, wdir):
+        if n_clicks is None or not url:
+            raise PreventUpdate
+        imported, errors = T.import_from_url(
+            url.strip(),
+            wdir,
+            progress_callback=lambda progress: fsc.set("progress", progress),
+        )
+        if len(errors) > 0:
+            return dbc.Alert(
+                [html.P(f"{len(imported)} files imported, {len(errors)} failed:")]
+                + [html.P(f"{file_url}: {error}") for file_url, error in errors.items()],
+                color="warning",
+            )
+        return dbc.Alert(f"{len(imported)} files imported.", color="success")
+
     @app.callback(
         Output({"index": "ms-delete-output", "type": "output"}, "children"),
         Input("ms-delete", "n_clicks"),
@@ -242,6 +332,9 @@ def callbacks(app, fsc, cache):
             fn = row["ms_file"]
             fn = P(target_dir) / fn
             os.remove(fn)
+            for fn_cache in [T.get_chromatogram_store_fn(fn, wdir), T.get_mz_sorted_fn(fn)]:
+                if os.path.isfile(fn_cache):
+                    os.remove(fn_cache)
         return dbc.Alert(f"{len(rows)} files deleted", color="info")
 
 
@@ -262,14 +355,46 @@ def callbacks(app, fsc, cache):
         if fns is None or len(fns)==0:
             raise PreventUpdate
         ms_dir = T.get_ms_dirname(wdir)
+        n_files = 0
         for fn in fns:
             if not P(fn).is_file():
                 continue
             fn_new = P(ms_dir) / P(fn).name
             shutil.move(fn, fn_new)
-            T.fix_first_emtpy_line_after_upload_workaround(fn_new)
             logging.info(f"Move {fn} to {fn_new}")
-        return dbc.Alert("Upload finished", color="success")
+            # Header fix, conversion and summary run in the background
+            T.MS_FILE_QUEUE.submit(fn_new, wdir)
+            n_files += 1
+        return dbc.Alert(
+            f"Upload finished, {n_files} files are prepared in the background.",
+            color="success",
+        )
+
+    @app.callback(
+        Output("ms-queue-status", "children"),
+        Output("ms-queue-n-pending", "children"),
+        Input("progress-interval", "n_intervals"),
+        State("ms-queue-n-pending", "children"),
+        State("wdir", "children"),
+    )
+    def ms_queue_status(n_intervals, n_pending_before, wdir):
+        pending, errors = T.MS_FILE_QUEUE.status(wdir)
+        children = []
+        if len(pending) > 0:
+            children.append(
+                dbc.Alert(f"{len(pending)} files are prepared in the background.", color="info")
+            )
+        if len(errors) > 0:
+            children.append(
+                dbc.Alert(
+                    [html.P(f"{len(errors)} files could not be prepared:")]
+                    + [html.P(f"{os.path.basename(fn)}: {error}") for fn, error in errors.items()],
+                    color="warning",
+                )
+            )
+        # Refresh the table only when files were finished
+        n_pending = len(pending) if len(pending) != n_pending_before else no_update
+        return children, n_pending
 
     @app.callback(Output("ms-n-files", "children"), Input("ms-table", "data"))
     def n_files(data):
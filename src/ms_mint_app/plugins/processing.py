@@ -83,7 +83,7 @@ def callbacks(app, fsc, cache):
     def heat_delete(n_clicks, wdir):
         if n_clicks is None:
             raise PreventUpdate
-        os.remove(T.get_results_fn(wdir))
+        T.delete_results(wdir)
         return dbc.Alert("Results file deleted.", color='success')
 
     @app.callback(
@@ -104,7 +104,7 @@ def callbacks(app, fsc, cache):
         prop_id = ctx.triggered[0]["prop_id"]
 
         if prop_id == "res-download.n_clicks":
-            fn = T.get_results_fn(wdir)
+            fn = T.export_results_csv(wdir)
             workspace = os.path.basename(wdir)
             return [
                 send_file(fn, filename=f"{T.today()}-MINT__{workspace}-long.csv")
@@ -112,7 +112,7 @@ def callbacks(app, fsc, cache):
 
         elif prop_id == "res-download-peakmax.n_clicks":
             workspace = os.path.basename(wdir)
-            results = T.get_results(wdir)
+            results = T.get_results(wdir, columns=["ms_file_label", "peak_label", property])
             df = results.pivot_table(property, "ms_file_label", "peak_label")
             if options is not None and 'Transposed' in options:
                 df = df.T
@@ -135,14 +135,24 @@ def callbacks(app, fsc, cache):
         def set_progress(x):
             fsc.set("progress", x)
 
-        mint = Mint(verbose=False, progress_callback=set_progress)
+        mint = Mint(verbose=False)
         targets_fn = T.get_targets_fn(wdir)
-        output_fn = T.get_results_fn(wdir)
         try:
             mint.load_targets(targets_fn)
-            mint.targets = mint.targets[mint.targets.rt_min.notna() & mint.targets.rt_max.notna()]
-            mint.ms_files = T.get_ms_fns(wdir)
-            mint.run(fn=output_fn)
+            targets = mint.targets[mint.targets.rt_min.notna() & mint.targets.rt_max.notna()]
+            summary = T.run_mint(
+                wdir,
+                targets,
+                T.get_ms_fns(wdir),
+                nthreads=T.get_ncpu(),
+                progress_callback=set_progress,
+            )
         except Exception as e:
             return dbc.Alert(str(e), color="danger")
-        return dbc.Alert("Finished running MINT", color="success")
+        computed, reused = summary["computed"], summary["reused"]
+        return dbc.Alert(
+            f"Finished running MINT: computed {computed['results']} results "
+            f"({computed['ms_files']} new or changed MS files, {computed['targets']} new or changed targets), "
+            f"reused {reused['results']} results.",
+            color="success",
+        )
@@ -5,6 +5,7 @@ from dash.exceptions import PreventUpdate
 from dash.dependencies import Input, Output, State
 
 import plotly.express as px
+import plotly.graph_objects as go
 
 import numpy as np
 import seaborn as sns
@@ -70,6 +71,23 @@ _layout = html.Div([
         )
     ),
 
+    html.H3('Total Ion Chromatograms'),
+    dcc.Markdown('Total ion chromatograms (TIC) of the MS1 scans of all files, taken from the MS file catalog of the workspace.', style=_markdown_style),
+    dcc.Loading(
+        html.Div(
+            dcc.Graph(
+                id="qc-fig-tic",
+                style={
+                    "margin": "auto",
+                    "marginTop": "10%",
+                    "text-align": "center",
+                    "maxWidth": "100%",
+                },
+            ),
+            style={'width': '100%', 'margin': 'auto'}
+        ),
+    ),
+
     html.H3('Principal Components Analysis'),
     dcc.Markdown('This graph visualizes differences between the different sample types set in `sample_type` column in the Metadata tab.', style=_markdown_style),
     dcc.Loading(
@@ -124,7 +142,7 @@ def callbacks(app, fsc, cache):
             raise PreventUpdate
         
         df = T.get_complete_results(
-            wdir
+            wdir, columns=["peak_mass_diff_50pc"]
         )
 
         return px.violin(data_frame=df, y='peak_mass_diff_50pc', color='sample_type', title='Peak Mass Difference')
@@ -142,7 +160,7 @@ def callbacks(app, fsc, cache):
             raise PreventUpdate
         
         df = T.get_complete_results(
-            wdir
+            wdir, columns=["peak_mass_diff_50pc", "ms_file"]
         )
 
         fig = px.scatter(data_frame=df, 
@@ -157,6 +175,30 @@ def callbacks(app, fsc, cache):
         return fig
 
 
+    @app.callback(
+        Output("qc-fig-tic", "figure"),
+        Input("tab", "value"),
+        State("wdir", "children"),
+    )
+    def create_tic(
+        tab,
+        wdir,
+    ):
+        if tab != "Quality Control":
+            raise PreventUpdate
+
+        catalog = T.get_ms_catalog(wdir, traces=True).dropna(subset=["tic"])
+        fig = go.Figure()
+        for _, entry in catalog.iterrows():
+            fig.add_trace(
+                go.Scattergl(
+                    x=entry.tic_scan_time, y=entry.tic, mode="lines", name=entry.ms_file_label
+                )
+            )
+        fig.update_layout(xaxis_title="Scan Time [s]", yaxis_title="TIC", height=500)
+        return fig
+
+
     @app.callback(
         Output("qc-fig-pca", "figure"),
         Input("tab", "value"),
@@ -171,7 +213,9 @@ def callbacks(app, fsc, cache):
             raise PreventUpdate
 
         mint = Mint()
-        mint.load(T.get_results_fn(wdir))
+        mint.results = T.get_results(wdir)
+        mint.digest_results()
+        T.compact_metadata(wdir)
         mint.load_metadata(T.get_metadata_fn(wdir))
 
         mint.pca.run(4)
@@ -198,7 +242,8 @@ def callbacks(app, fsc, cache):
             raise PreventUpdate
 
         mint = Mint()
-        mint.load(T.get_results_fn(wdir))
+        mint.results = T.get_results(wdir)
+        mint.digest_results()
 
         # select 30 random files at max
         fns = mint.ms_files
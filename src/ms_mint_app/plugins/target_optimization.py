@@ -58,17 +58,15 @@ def create_preview_peakshape(
     """Create peak shape previews."""
     logging.info(f'Create_preview_peakshape {peak_label}')
     fig, ax = plt.subplots(figsize=(2, 1), dpi=30)
-    y_max = 0
-    for fn in ms_files:
+    time_points, intensities = T.get_chromatogram_matrix(
+        ms_files, mz_mean, mz_width, wdir, rt_min=rt_min, rt_max=rt_max
+    )
+    for fn, intensity in zip(ms_files, intensities):
         color = colors[T.filename_to_label(fn)]
         if color is None or color == "":
             color = "grey"
-        fn_chro = T.get_chromatogram(fn, mz_mean, mz_width, wdir)
-        fn_chro = fn_chro[
-            (rt_min < fn_chro["scan_time"]) & (fn_chro["scan_time"] < rt_max)
-        ]
-        ax.plot(fn_chro["scan_time"], fn_chro["intensity"], lw=1, color=color)
-        y_max = max(y_max, fn_chro["intensity"].max())
+        ax.plot(time_points, intensity, lw=1, color=color)
+    y_max = intensities.max() if intensities.size > 0 else 0
     if (not np.isnan(rt)) and not (np.isnan(rt_max)) and not (np.isnan(rt_min)):
         x = max(min(rt, rt_max), rt_min)
         rt_mean = np.mean([rt_min, rt_max])
@@ -377,18 +375,12 @@ def callbacks(app, fsc, cache, cpu=None):
                 x0=rt_min, x1=rt_max, line_width=0, fillcolor="green", opacity=0.1
             )
 
-        n_files = len(ms_files)
-        for i, fn in tqdm(enumerate(ms_files), total=n_files, desc="PKO-figure"):
-            fsc.set("progress", int(100 * (i + 1) / n_files))
-
-            name = os.path.basename(fn)
-            name, _ = os.path.splitext(name)
-            chrom = T.get_chromatogram(fn, mz_mean, mz_width, wdir)
-            fig.add_trace(
-                go.Scatter(x=chrom["scan_time"], y=chrom["intensity"], name=name)
-            )
-            fig.update_layout(showlegend=False)
-            fig.update_layout(hoverlabel=dict(namelength=-1))
+        time_points, intensities = T.get_chromatogram_matrix(ms_files, mz_mean, mz_width, wdir)
+        for fn, intensity in zip(ms_files, intensities):
+            name = T.filename_to_label(fn)
+            fig.add_trace(go.Scatter(x=time_points, y=intensity, name=name))
+        fig.update_layout(showlegend=False)
+        fig.update_layout(hoverlabel=dict(namelength=-1))
         return fig
 
     @app.callback(
@@ -534,6 +526,12 @@ def callbacks(app, fsc, cache, cpu=None):
 
         n_total = len(targets)
 
+        def set_progress(x):
+            fsc.set("progress", x)
+
+        # Extract the chromatograms of all targets with one pass per file
+        T.Chromatograms(wdir, targets, ms_files, progress_callback=set_progress).create_all()
+
         sns.set_context("paper")
         images = []
         for i, (peak_label, row) in tqdm(enumerate(targets.iterrows()), total=n_total):
@@ -656,7 +654,8 @@ def callbacks(app, fsc, cache, cpu=None):
         mint.ms_files = ms_files
         
         # Only detect RT for this specific peak
-        mint.opt.detect_largest_peak_rt(peak_labels=[peak_label])
+        with T.cached_ms_file_reader():
+            mint.opt.detect_largest_peak_rt(peak_labels=[peak_label])
         T.write_targets(mint.targets, wdir)
         
         return dbc.Alert(f"Detected RT for {peak_label}", color="info")
@@ -688,7 +687,8 @@ def callbacks(app, fsc, cache, cpu=None):
         mint.ms_files = ms_files
         
         # Detect RT for all targets
-        mint.opt.detect_largest_peak_rt()
+        with T.cached_ms_file_reader():
+            mint.opt.detect_largest_peak_rt()
         T.write_targets(mint.targets, wdir)
         
         return dbc.Alert("Detected RT for all targets", color="success")
@@ -727,7 +727,8 @@ def callbacks(app, fsc, cache, cpu=None):
         mint.ms_files = ms_files
         
         # Only optimize this specific peak
-        mint.opt.rt_min_max(peak_labels=[peak_label], rel_height=0.8)
+        with T.cached_ms_file_reader():
+            mint.opt.rt_min_max(peak_labels=[peak_label], rel_height=0.8)
         T.write_targets(mint.targets, wdir)
         
         return dbc.Alert(f"Optimized RT span for {peak_label}", color="info")
@@ -759,7 +760,8 @@ def callbacks(app, fsc, cache, cpu=None):
         mint.ms_files = ms_files
         
         # Optimize all targets (don't specify peak_labels)
-        mint.opt.rt_min_max(rel_height=0.8)
+        with T.cached_ms_file_reader():
+            mint.opt.rt_min_max(rel_height=0.8)
         T.write_targets(mint.targets, wdir)
         
         return dbc.Alert("Optimized RT span for all targets", color="success")
@@ -821,13 +823,14 @@ def callbacks(app, fsc, cache, cpu=None):
         zoom_fig = go.Figure()
 
         # Add chromatogram traces
-        for fn in ms_files:
-            chrom = T.get_chromatogram(fn, mz_mean, mz_width, wdir)
-                        
+        time_points, intensities = T.get_chromatogram_matrix(ms_files, mz_mean, mz_width, wdir)
+        in_range = (time_points >= rt_min) & (time_points <= rt_max)
+        for fn, intensity in zip(ms_files, intensities):
+
             # Full figure trace
             full_fig.add_trace(go.Scattergl(
-                x=chrom['scan_time'], 
-                y=chrom['intensity'], 
+                x=time_points, 
+                y=intensity, 
                 mode='markers', 
                 fill='tozeroy',
                 marker=dict(size=3),
@@ -835,13 +838,9 @@ def callbacks(app, fsc, cache, cpu=None):
             ))
             
             # Zoom figure trace (filtered to RT range)
-            zoom_chrom = chrom[
-                (chrom['scan_time'] >= rt_min) & 
-                (chrom['scan_time'] <= rt_max)
-            ]
             zoom_fig.add_trace(go.Scattergl(
-                x=zoom_chrom['scan_time'], 
-                y=zoom_chrom['intensity'], 
+                x=time_points[in_range], 
+                y=intensity[in_range], 
                 mode='markers',
                 fill='tozeroy',
                 marker=dict(size=3),
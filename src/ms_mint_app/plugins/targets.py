@@ -207,6 +207,13 @@ def callbacks(app, fsc=None, cache=None):
         if len(df) == 0:
             df = pd.DataFrame(columns=TARGETS_COLUMNS)
         T.write_targets(df, wdir)
+        messages = T.check_targets_against_ms_catalog(df, wdir)
+        if len(messages) > 0:
+            return dbc.Alert(
+                [html.P("Target list saved. Some targets are not covered by the MS files:")]
+                + [html.P(message) for message in messages],
+                color="warning",
+            )
         return dbc.Alert("Target list saved.", color="success")
 
     @app.callback(
@@ -7,7 +7,6 @@ import multiprocessing
 import argparse
 import pkg_resources
 import xlsxwriter
-import bs4
 import logging
 
 from waitress import serve
@@ -145,6 +144,24 @@ def main():
         type=int,
         help='Number of CPUs to use',
     )
+    parser.add_argument(
+        "--ms-file-cache-mb",
+        default=None,
+        type=float,
+        help="Memory budget in MB for caching parsed MS files in the app process, workers do not cache (default: 2048)",
+    )
+    parser.add_argument(
+        "--chromatogram-dtype",
+        default=None,
+        choices=["float32", "float64"],
+        help="Storage precision of chromatograms (default: float32)",
+    )
+    parser.add_argument(
+        "--chromatogram-compression",
+        default=None,
+        choices=["zstd", "lz4", "none"],
+        help="Compression of chromatogram files (default: zstd)",
+    )
     args = parser.parse_args()
 
     if args.version:
@@ -169,6 +186,18 @@ def main():
     if args.serve_path is not None:
         os.environ["MINT_SERVE_PATH"] = args.serve_path
 
+    if args.ncpu is not None:
+        os.environ["MINT_NCPU"] = str(args.ncpu)
+
+    if args.ms_file_cache_mb is not None:
+        os.environ["MINT_MS_FILE_CACHE_MB"] = str(args.ms_file_cache_mb)
+
+    if args.chromatogram_dtype is not None:
+        os.environ["MINT_CHROMATOGRAM_DTYPE"] = args.chromatogram_dtype
+
+    if args.chromatogram_compression is not None:
+        os.environ["MINT_CHROMATOGRAM_COMPRESSION"] = args.chromatogram_compression
+
     # Set logging level - use WARNING unless debug mode
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.DEBUG if args.debug else logging.WARNING)
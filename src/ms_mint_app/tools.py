@@ -4,10 +4,18 @@ import shutil
 import base64
 import subprocess
 import platform
+import json
+import hashlib
 import logging
+import multiprocessing
+import threading
+import time
+import sqlite3
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from tqdm import tqdm
 from glob import glob
@@ -15,8 +23,8 @@ import pathlib
 from pathlib import Path as P
 
 import urllib3, ftplib
-from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse, urljoin, quote, unquote
+from html.parser import HTMLParser
 
 import matplotlib as mpl
 from typing import Union, Optional
@@ -26,13 +34,27 @@ mpl.use("Agg")
 from matplotlib import pyplot as plt
 import matplotlib.cm as cm
 
+from pyteomics import mzml, mzxml
+
 import ms_mint
+import ms_mint.TargetOptimizer
+from ms_mint.Mint import Mint
 from ms_mint.io import ms_file_to_df
 from ms_mint.targets import standardize_targets, read_targets
 from ms_mint.io import convert_ms_file_to_feather
-from ms_mint.standards import TARGETS_COLUMNS
+from ms_mint.standards import TARGETS_COLUMNS, MINT_RESULTS_COLUMNS
 
 from datetime import date
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+    FIRST_COMPLETED,
+)
 
 from .filelock import FileLock
 
@@ -41,8 +63,8 @@ def list_to_options(x):
     return [{"label": e, "value": e} for e in x]
 
 
-def lock(fn):
-    return FileLock(f"{fn}.lock", timeout=1)
+def lock(fn, timeout=1):
+    return FileLock(f"{fn}.lock", timeout=timeout)
 
 
 def today():
@@ -68,17 +90,35 @@ def get_issue_text():
 
 
 def parse_ms_files(contents, filename, date, target_dir):
-    content_type, content_string = contents.split(",")
-    decoded = base64.b64decode(content_string)
     fn_abs = os.path.join(target_dir, filename)
     with lock(fn_abs):
-        with open(fn_abs, "wb") as file:
-            file.write(decoded)
-    new_fn = convert_ms_file_to_feather(fn_abs)
-    if os.path.isfile(new_fn):
+        write_data_url_to_file(contents, fn_abs)
+    new_fn = convert_ms_file(fn_abs)
+    if os.path.isfile(new_fn) and new_fn != fn_abs:
         os.remove(fn_abs)
 
 
+def write_data_url_to_file(contents: str, fn, chunk_size: int = 2**22):
+    """
+    Decode a base64 data URL straight to a file.
+
+    The data is decoded in chunks of `chunk_size` characters, so
+    no decoded copy of the complete content is held in memory.
+
+    Args:
+        contents: Data URL 'data:<type>;base64,<data>'
+        fn: Output filename
+        chunk_size: Number of base64 characters decoded at once
+    """
+    start = contents.index(",") + 1
+    chunk_size -= chunk_size % 4
+    fn_tmp = f"{fn}.tmp"
+    with open(fn_tmp, "wb") as file:
+        for i in range(start, len(contents), chunk_size):
+            file.write(base64.b64decode(contents[i : i + chunk_size]))
+    os.replace(fn_tmp, fn)
+
+
 def parse_pkl_files(contents, filename, date, target_dir, ms_mode=None):
     content_type, content_string = contents.split(",")
     decoded = base64.b64decode(content_string)
@@ -179,6 +219,115 @@ def get_workspaces(tmpdir):
     return ws_names
 
 
+class MsFileCache:
+    """Process-wide LRU cache of parsed MS files.
+
+    Entries are keyed by path, modification time and size of the
+    file, so a replaced file is parsed again. The least recently
+    used entries are evicted when the memory budget is exceeded.
+    The budget applies to each process, worker processes that
+    read every file once do not cache, see `_disable_ms_file_cache()`.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fn):
+        key = self._get_key(fn)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            self.misses += 1
+        df = ms_file_to_df(fn)
+        if df is not None:
+            self._add(key, df)
+        return df
+
+    def info(self):
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                n_files=len(self._entries),
+                n_bytes=self.n_bytes,
+                max_bytes=self.max_bytes,
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+
+    def _add(self, key, df):
+        # Deep, the polarity strings are objects
+        n_bytes = int(df.memory_usage(index=True, deep=True).sum())
+        if n_bytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (df, n_bytes)
+            self.n_bytes += n_bytes
+            while self.n_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.n_bytes -= evicted
+
+    @staticmethod
+    def _get_key(fn):
+        stat = os.stat(fn)
+        return (os.path.abspath(fn), stat.st_mtime_ns, stat.st_size)
+
+
+MS_FILE_CACHE = MsFileCache(
+    max_bytes=int(float(os.getenv("MINT_MS_FILE_CACHE_MB", 2048)) * 1024 * 1024)
+)
+
+
+def _disable_ms_file_cache():
+    # Initializer of worker processes, a cache per worker would
+    # multiply the memory budget
+    MS_FILE_CACHE.max_bytes = 0
+
+
+def read_ms_file(fn):
+    """
+    Read an MS file through the process-wide cache.
+
+    The returned DataFrame is shared with the cache and
+    must not be modified in place.
+    """
+    return MS_FILE_CACHE.get(fn)
+
+
+_MS_FILE_READER_LOCK = threading.Lock()
+
+
+@contextmanager
+def cached_ms_file_reader():
+    """
+    Let the target optimization of ms_mint read MS files through
+    `read_ms_file()` while the context is active.
+
+    ms_mint looks up its reader as a module global, so it is replaced
+    only for the duration of the context and optimizations running
+    in other threads are serialized.
+    """
+    with _MS_FILE_READER_LOCK:
+        original = ms_mint.TargetOptimizer.ms_file_to_df
+        ms_mint.TargetOptimizer.ms_file_to_df = read_ms_file
+        try:
+            yield
+        finally:
+            ms_mint.TargetOptimizer.ms_file_to_df = original
+
+
 class Chromatograms:
     def __init__(self, wdir, targets, ms_files, progress_callback=None):
         self.wdir = wdir
@@ -188,178 +337,1907 @@ class Chromatograms:
         self.n_files = len(ms_files)
         self.progress_callback = progress_callback
 
-    def create_all(self):
-        for fn in tqdm(self.ms_files):
-            self.create_all_for_ms_file(fn)
-        return self
+    def create_all(self, ncpu=None):
+        """Create the chromatograms of all MS files.
+
+        The files are distributed over a pool of worker processes,
+        one MS file per task. The number of workers defaults to
+        the value of `--ncpu` and is capped at the number of files.
+        """
+        ms_files = self.get_incomplete_ms_files()
+        n_files = len(ms_files)
+        if n_files == 0:
+            self._set_progress(1, 1)
+            return self
+
+        if ncpu is None:
+            ncpu = get_ncpu()
+        if ncpu is None:
+            ncpu = multiprocessing.cpu_count()
+        ncpu = min(ncpu, n_files)
+
+        if ncpu <= 1:
+            for i, fn in enumerate(tqdm(ms_files)):
+                self.create_all_for_ms_file(fn)
+                self._set_progress(i + 1, n_files)
+            return self
+
+        targets = self.targets[["mz_mean", "mz_width"]]
+        with ProcessPoolExecutor(max_workers=ncpu, initializer=_disable_ms_file_cache) as executor:
+            futures = [
+                executor.submit(_create_chromatograms_for_ms_file, self.wdir, targets, fn)
+                for fn in ms_files
+            ]
+            for i, future in enumerate(tqdm(as_completed(futures), total=n_files)):
+                future.result()
+                self._set_progress(i + 1, n_files)
+        return self
+
+    def _set_progress(self, n_done, n_total):
+        if self.progress_callback is not None:
+            self.progress_callback(int(100 * n_done / n_total))
+
+    def get_incomplete_ms_files(self, time_step: float = 0.25):
+        """Return the MS files with missing or outdated chromatograms.
+
+        Stores of MS files that were replaced since the chromatograms
+        were extracted are removed, so that they are rebuilt.
+        """
+        windows = get_target_windows(self.targets).drop_duplicates("key")
+        return [
+            fn
+            for fn in self.ms_files
+            if len(self._get_missing_windows(fn, windows, time_step)) > 0
+        ]
+
+    def _get_missing_windows(self, ms_file, windows, time_step):
+        fn_store = get_chromatogram_store_fn(ms_file, self.wdir)
+        validate_chromatogram_store(fn_store, ms_file)
+        params = read_chromatogram_manifest(fn_store).get("params", {})
+        current = {
+            key for key, value in params.items()
+            if value == get_chromatogram_params(time_step)
+        }
+        return windows[~windows["key"].isin(current)]
+
+    def create_all_for_ms_file(self, ms_file: str, time_step: float = 0.25):
+        """Create all missing chromatograms for one MS file.
+
+        The file is read once and all target windows are cut
+        from the m/z sorted data in a single pass.
+        """
+        fn_store = get_chromatogram_store_fn(ms_file, self.wdir)
+        windows = get_target_windows(self.targets).drop_duplicates("key")
+        windows = self._get_missing_windows(ms_file, windows, time_step)
+        if len(windows) == 0:
+            return
+        create_chromatograms_for_windows(ms_file, windows, fn_store, time_step=time_step)
+
+    def get_single(self, mz_mean, mz_width, ms_file):
+        return get_chromatogram(ms_file, mz_mean, mz_width, self.wdir)
+
+
+def _create_chromatograms_for_ms_file(wdir, targets, ms_file):
+    # Entry point for the worker processes of Chromatograms.create_all()
+    Chromatograms(wdir, targets, [ms_file]).create_all_for_ms_file(ms_file)
+
+
+def create_chromatograms(ms_files, targets, wdir):
+    Chromatograms(wdir, targets, ms_files).create_all()
+
+
+def get_ncpu():
+    """Returns the number of CPUs set with `--ncpu`, or None if not set."""
+    ncpu = os.getenv("MINT_NCPU")
+    if ncpu is None or ncpu == "":
+        return None
+    return int(ncpu)
+
+
+def extract_chromatograms(
+    df: pd.DataFrame, mz_means: np.ndarray, mz_widths: np.ndarray
+) -> list:
+    """
+    Extract the chromatograms of many m/z windows in one pass.
+
+    The data is sorted by m/z once and every window is cut
+    with a binary search instead of masking the full table
+    for each target.
+
+    Args:
+        df: MS data with columns 'scan_time', 'mz' and 'intensity'
+        mz_means: Mean m/z values of the windows
+        mz_widths: Widths of the windows in ppm
+
+    Returns:
+        list: One DataFrame with columns 'scan_time' and 'intensity'
+              per window holding the maximum intensity per scan time
+    """
+    mz_means = np.asarray(mz_means, dtype=np.float64)
+    dmz = mz_means * 1e-6 * np.asarray(mz_widths, dtype=np.float64)
+
+    mz = df["mz"].to_numpy()
+    order = np.argsort(mz, kind="stable")
+    mz = mz[order]
+    scan_time = df["scan_time"].to_numpy()[order]
+    intensity = df["intensity"].to_numpy()[order]
+
+    starts = np.searchsorted(mz, mz_means - dmz, side="left")
+    stops = np.searchsorted(mz, mz_means + dmz, side="right")
+
+    # Gather the rows of all windows for the batched reduction
+    lengths = stops - starts
+    offsets = np.cumsum(lengths) - lengths
+    rows = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+
+    return max_intensity_per_scan_time(scan_time[rows], intensity[rows], lengths)
+
+
+def extract_chromatograms_from_ms_file(ms_file, mz_means, mz_widths) -> list:
+    """
+    Extract the chromatograms of many m/z windows from an MS file.
+
+    Uses the m/z sorted copy of the file if there is a valid one,
+    so that only the blocks overlapping the windows are read.
+    Otherwise the whole file is read.
+    """
+    mz_means = np.asarray(mz_means, dtype=np.float64)
+    dmz = mz_means * 1e-6 * np.asarray(mz_widths, dtype=np.float64)
+    fn_sorted = get_mz_sorted_fn(ms_file)
+    if has_valid_mz_sorted_copy(ms_file):
+        slices = read_mz_windows(fn_sorted, mz_means - dmz, mz_means + dmz)
+        if len(slices) == 0:
+            return []
+        scan_time, intensity = [np.concatenate(x) for x in zip(*slices)]
+        lengths = np.array([len(x) for x, _ in slices])
+        return max_intensity_per_scan_time(scan_time, intensity, lengths)
+    df = read_ms_file(ms_file)
+    return extract_chromatograms(df, mz_means, mz_widths)
+
+
+def max_intensity_per_scan_time(scan_time, intensity, lengths) -> list:
+    """
+    Reduce the data points of many chromatograms to the maximum
+    intensity per scan time in one vectorized call.
+
+    Args:
+        scan_time: Concatenated scan times of all chromatograms
+        intensity: Concatenated intensities of all chromatograms
+        lengths: Number of data points of each chromatogram
+
+    Returns:
+        list: One DataFrame with columns 'scan_time' and 'intensity'
+              per chromatogram sorted by scan time
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    n_chroms = len(lengths)
+    chrom_ids = np.repeat(np.arange(n_chroms), lengths)
+
+    valid = ~np.isnan(scan_time)
+    scan_time, intensity, chrom_ids = scan_time[valid], intensity[valid], chrom_ids[valid]
+
+    # Sort by chromatogram and scan time and reduce each run of equal keys
+    order = np.lexsort((scan_time, chrom_ids))
+    scan_time, intensity, chrom_ids = scan_time[order], intensity[order], chrom_ids[order]
+    is_first = np.ones(len(scan_time), dtype=bool)
+    is_first[1:] = (chrom_ids[1:] != chrom_ids[:-1]) | (scan_time[1:] != scan_time[:-1])
+    firsts = np.flatnonzero(is_first)
+    if len(firsts) > 0:
+        max_intensity = np.maximum.reduceat(intensity, firsts)
+    else:
+        max_intensity = intensity[:0]
+    scan_time, chrom_ids = scan_time[firsts], chrom_ids[firsts]
+
+    bounds = np.searchsorted(chrom_ids, np.arange(n_chroms + 1))
+    return [
+        pd.DataFrame(
+            {
+                "scan_time": scan_time[start:stop],
+                "intensity": max_intensity[start:stop],
+            }
+        )
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+MZ_SORTED_BLOCK_SIZE = 65536
+
+
+def get_mz_sorted_fn(ms_file):
+    return os.path.splitext(str(ms_file))[0] + ".mzsorted.arrow"
+
+
+def write_mz_sorted_ms_file(ms_file, fn_out=None, block_size=MZ_SORTED_BLOCK_SIZE):
+    """
+    Write a copy of an MS file sorted by m/z.
+
+    The copy is an uncompressed Arrow IPC file with the columns
+    'mz', 'scan_time' and 'intensity' in blocks of `block_size`
+    rows. The first m/z value of every block is stored in the
+    schema metadata, so that a m/z range can be looked up in the
+    memory mapped file by reading only the overlapping blocks.
+    The original file stays in scan order, because peak
+    integration depends on it.
+
+    Args:
+        ms_file: Path to the MS file
+        fn_out: Output filename, defaults to `get_mz_sorted_fn(ms_file)`
+        block_size: Number of rows per block
+
+    Returns:
+        str: Filename of the m/z sorted copy
+    """
+    if fn_out is None:
+        fn_out = get_mz_sorted_fn(ms_file)
+    df = read_ms_file(ms_file)
+    order = np.argsort(df["mz"].to_numpy(), kind="stable")
+    table = pa.table(
+        {
+            "mz": df["mz"].to_numpy()[order],
+            "scan_time": df["scan_time"].to_numpy()[order],
+            "intensity": df["intensity"].to_numpy()[order],
+        }
+    )
+    batches = table.to_batches(max_chunksize=block_size)
+    stat = os.stat(ms_file)
+    metadata = {
+        "mz_index": json.dumps([float(batch.column("mz")[0].as_py()) for batch in batches]),
+        "source": json.dumps([stat.st_size, stat.st_mtime_ns]),
+    }
+    schema = table.schema.with_metadata(metadata)
+    fn_tmp = f"{fn_out}.tmp"
+    with pa.OSFile(fn_tmp, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+    os.replace(fn_tmp, fn_out)
+    return fn_out
+
+
+def has_valid_mz_sorted_copy(ms_file):
+    """Check if a m/z sorted copy of the MS file exists and is up to date."""
+    fn = get_mz_sorted_fn(ms_file)
+    if not os.path.isfile(fn):
+        return False
+    try:
+        with pa.memory_map(fn, "r") as source:
+            metadata = pa.ipc.open_file(source).schema.metadata
+        size, mtime_ns = json.loads(metadata[b"source"])
+    except Exception:
+        return False
+    stat = os.stat(ms_file)
+    return (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+
+
+def read_mz_windows(fn, mz_lows, mz_highs) -> list:
+    """
+    Read the data of m/z ranges from a m/z sorted MS file.
+
+    Args:
+        fn: Filename of the m/z sorted copy
+        mz_lows: Lower bounds of the m/z ranges
+        mz_highs: Upper bounds of the m/z ranges
+
+    Returns:
+        list: Tuples of (scan_time, intensity) arrays per range
+    """
+    slices = []
+    with pa.memory_map(str(fn), "r") as source:
+        reader = pa.ipc.open_file(source)
+        block_starts = np.array(json.loads(reader.schema.metadata[b"mz_index"]))
+        n_blocks = len(block_starts)
+        firsts = np.searchsorted(block_starts, mz_lows, side="left") - 1
+        lasts = np.searchsorted(block_starts, mz_highs, side="right") - 1
+        for mz_low, mz_high, first, last in zip(mz_lows, mz_highs, firsts, lasts):
+            if n_blocks == 0 or last < 0:
+                slices.append((np.array([]), np.array([])))
+                continue
+            batches = [reader.get_batch(i) for i in range(max(first, 0), last + 1)]
+            mz, scan_time, intensity = [
+                np.concatenate([batch.column(col).to_numpy() for batch in batches])
+                for col in ["mz", "scan_time", "intensity"]
+            ]
+            start = np.searchsorted(mz, mz_low, side="left")
+            stop = np.searchsorted(mz, mz_high, side="right")
+            slices.append((scan_time[start:stop].copy(), intensity[start:stop].copy()))
+    return slices
+
+
+def convert_ms_file(fn, fn_out=None, mz_sorted=False):
+    """
+    Convert an MS file to feather format.
+
+    Args:
+        fn: Path to the MS file
+        fn_out: Output filename, defaults to the input with '.feather' suffix
+        mz_sorted: Also write a m/z sorted copy for fast
+                   chromatogram extraction
+
+    Returns:
+        str: Filename of the feather file
+    """
+    if str(fn).lower().endswith(".feather"):
+        fn_out = str(fn)
+    elif str(fn).lower().endswith((".mzml", ".mzxml")):
+        fn_out = stream_ms_file_to_feather(fn, fn_out)
+    else:
+        fn_out = convert_ms_file_to_feather(fn, fn_out)
+    if mz_sorted and os.path.isfile(fn_out):
+        write_mz_sorted_ms_file(fn_out)
+    return fn_out
+
+
+MS_FILE_SCHEMA = pa.schema(
+    [
+        ("scan_id", pa.int64()),
+        ("ms_level", pa.int8()),
+        ("polarity", pa.string()),
+        ("scan_time", pa.float32()),
+        ("mz", pa.float32()),
+        ("intensity", pa.int64()),
+    ]
+)
+
+MS_FILE_BATCH_SIZE = 2**20
+
+
+def stream_ms_file_to_feather(fn, fn_out=None, batch_size=MS_FILE_BATCH_SIZE):
+    """
+    Convert an mzML or mzXML file to feather format with bounded memory.
+
+    The spectra are parsed one at a time and written in record
+    batches of about `batch_size` rows, so the memory use does not
+    depend on the size of the file. The result has the same columns
+    and dtypes as `ms_mint.io.convert_ms_file_to_feather()`.
+
+    Args:
+        fn: Path to the mzML or mzXML file
+        fn_out: Output filename, defaults to the input with '.feather' suffix
+        batch_size: Number of rows per record batch
+
+    Returns:
+        str: Filename of the feather file
+    """
+    if fn_out is None:
+        fn_out = P(fn).with_suffix(".feather")
+    fn_out = str(fn_out)
+    if str(fn).lower().endswith(".mzml"):
+        spectra = _iter_mzml_spectra(fn)
+    elif str(fn).lower().endswith(".mzxml"):
+        spectra = _iter_mzxml_spectra(fn)
+    else:
+        raise ValueError(f"Cannot stream file {fn}.")
+
+    compression = "lz4" if pa.Codec.is_available("lz4") else None
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    fn_tmp = f"{fn_out}.tmp"
+    try:
+        with pa.OSFile(fn_tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, MS_FILE_SCHEMA, options=options) as writer:
+                chunk, n_rows = [], 0
+                for spectrum in spectra:
+                    chunk.append(spectrum)
+                    n_rows += len(spectrum[4])
+                    if n_rows >= batch_size:
+                        writer.write_batch(_spectra_to_batch(chunk))
+                        chunk, n_rows = [], 0
+                if len(chunk) > 0:
+                    writer.write_batch(_spectra_to_batch(chunk))
+        os.replace(fn_tmp, fn_out)
+    finally:
+        if os.path.isfile(fn_tmp):
+            os.remove(fn_tmp)
+    return fn_out
+
+
+def _spectra_to_batch(spectra):
+    # spectra: list of (scan_id, ms_level, polarity, scan_time, mz, intensity)
+    lengths = [len(mz) for _, _, _, _, mz, _ in spectra]
+    return pa.record_batch(
+        [
+            pa.array(np.repeat([x[0] for x in spectra], lengths).astype(np.int64)),
+            pa.array(np.repeat([x[1] for x in spectra], lengths).astype(np.int8)),
+            pa.array(np.repeat(np.array([x[2] for x in spectra], dtype=object), lengths), pa.string()),
+            pa.array(np.repeat([x[3] for x in spectra], lengths).astype(np.float32)),
+            pa.array(np.concatenate([x[4] for x in spectra]).astype(np.float32)),
+            pa.array(np.concatenate([x[5] for x in spectra]).astype(np.int64)),
+        ],
+        schema=MS_FILE_SCHEMA,
+    )
+
+
+def _iter_mzml_spectra(fn):
+    with mzml.read(str(fn)) as reader:
+        for spectrum in reader:
+            scan = spectrum["scanList"]["scan"][0]
+            scan_time = scan["scan start time"]
+            if scan_time.unit_info == "minute":
+                scan_time = scan_time * 60.0
+            if "positive scan" in spectrum:
+                polarity = "+"
+            elif "negative scan" in spectrum:
+                polarity = "-"
+            else:
+                polarity = None
+            yield (
+                int(spectrum["id"].split("=")[-1]),
+                spectrum["ms level"],
+                polarity,
+                float(scan_time),
+                np.asarray(spectrum["m/z array"], dtype=np.float64),
+                np.asarray(spectrum["intensity array"], dtype=np.float64),
+            )
+
+
+def _iter_mzxml_spectra(fn):
+    with mzxml.MzXML(str(fn)) as reader:
+        for spectrum in reader:
+            yield (
+                int(spectrum["num"]),
+                spectrum["msLevel"],
+                spectrum.get("polarity", None),
+                # Retention times are read in minutes
+                float(spectrum["retentionTime"]) * 60.0,
+                np.asarray(spectrum["m/z array"], dtype=np.float64),
+                np.asarray(spectrum["intensity array"], dtype=np.float64),
+            )
+
+
+def convert_ms_files(
+    fns, fns_out=None, mz_sorted=False, ncpu=None, progress_callback=None
+):
+    """
+    Convert many MS files to feather format in parallel.
+
+    The files are converted by a pool of worker processes with at
+    most two pending files per worker. A file that cannot be
+    converted does not stop the conversion of the others.
+
+    Args:
+        fns: Paths to the MS files
+        fns_out: Output filenames, default to the inputs with '.feather' suffix
+        mz_sorted: Also write m/z sorted copies, see `convert_ms_file()`
+        ncpu: Number of worker processes, defaults to `--ncpu` or all CPUs
+        progress_callback: Called with the progress in percent
+
+    Returns:
+        tuple: (converted, errors) mapping the input filenames to the
+               feather filenames and to the error messages, respectively
+    """
+    fns = list(fns)
+    if fns_out is None:
+        fns_out = [None] * len(fns)
+    n_files = len(fns)
+    converted, errors = {}, {}
+
+    def _collect(fn, result, i):
+        fn_out, error = result
+        if error is None:
+            converted[fn] = fn_out
+        else:
+            logging.warning(f"Could not convert {fn}: {error}")
+            errors[fn] = error
+        if progress_callback is not None:
+            progress_callback(int(100 * i / n_files))
+
+    if ncpu is None:
+        ncpu = get_ncpu()
+    if ncpu is None:
+        ncpu = multiprocessing.cpu_count()
+    ncpu = min(ncpu, n_files)
+
+    if ncpu <= 1:
+        for i, (fn, fn_out) in enumerate(tqdm(list(zip(fns, fns_out)))):
+            _collect(fn, _convert_ms_file(fn, fn_out, mz_sorted), i + 1)
+        return converted, errors
+
+    tasks = iter(zip(fns, fns_out))
+    n_done = 0
+    with ProcessPoolExecutor(max_workers=ncpu, initializer=_disable_ms_file_cache) as executor, tqdm(total=n_files) as pbar:
+        pending = {}
+        while True:
+            while len(pending) < 2 * ncpu:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                fn, fn_out = task
+                pending[executor.submit(_convert_ms_file, fn, fn_out, mz_sorted)] = fn
+            if len(pending) == 0:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                n_done += 1
+                _collect(pending.pop(future), future.result(), n_done)
+                pbar.update()
+    return converted, errors
+
+
+def _convert_ms_file(fn, fn_out, mz_sorted):
+    # Entry point for the worker processes of convert_ms_files(),
+    # errors are returned as text since not all of them can be pickled
+    try:
+        return convert_ms_file(fn, fn_out, mz_sorted=mz_sorted), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def resample_chromatogram(chrom: pd.DataFrame, time_step: float = 0.25) -> pd.DataFrame:
+    """
+    Interpolate a chromatogram onto equidistant time points.
+
+    Args:
+        chrom: Chromatogram with columns 'scan_time' and 'intensity'
+        time_step: Time step for equidistant time points (default: 0.25)
+
+    Returns:
+        pd.DataFrame: Chromatogram with equidistant time points
+                      Returns empty DataFrame if no data is found
+    """
+    if chrom.empty:
+        return pd.DataFrame(columns=["scan_time", "intensity"])
+
+    # Determine start and end times
+    start_time: float = chrom["scan_time"].min()
+    end_time: float = chrom["scan_time"].max()
+
+    # Check if start_time or end_time is NaN
+    if np.isnan(start_time) or np.isnan(end_time):
+        return pd.DataFrame(columns=["scan_time", "intensity"])
+
+    # Create equidistant time points
+    time_points: np.ndarray = np.arange(start_time, end_time + time_step, time_step)
+
+    # Interpolate intensities
+    interpolated_intensities: np.ndarray = np.interp(
+        time_points,
+        chrom["scan_time"],
+        chrom["intensity"]
+    )
+
+    # Create new equidistant DataFrame
+    equidistant_chrom: pd.DataFrame = pd.DataFrame({
+        "scan_time": time_points,
+        "intensity": interpolated_intensities
+    })
+
+    # Round scan time to 3 decimal places
+    equidistant_chrom["scan_time"] = equidistant_chrom["scan_time"].round(3)
+
+    return equidistant_chrom
+
+
+CHROMATOGRAM_STORE_VERSION = 1
+
+
+def write_chromatograms(
+    fn: Union[str, pathlib.Path],
+    chroms: dict,
+    source: Optional[dict] = None,
+    params: Optional[dict] = None,
+):
+    """
+    Add chromatograms to a chromatogram store.
+
+    A store holds all chromatograms of one MS file in a single
+    Arrow IPC file with one record batch per chromatogram. The
+    keys of the chromatograms are kept in the schema metadata,
+    so that a single chromatogram can be read without touching
+    the others. Existing chromatograms with the same key are
+    replaced.
+
+    The schema metadata also holds a manifest with the fingerprint
+    of the source MS file and the extraction parameters of each
+    chromatogram. If the source differs from the one recorded in
+    the store, the existing chromatograms are discarded.
+
+    Args:
+        fn: Filename of the chromatogram store
+        chroms: Mapping of chromatogram keys to DataFrames with
+                columns 'scan_time' and 'intensity'
+        source: Fingerprint of the MS file, see `get_ms_file_fingerprint()`
+        params: Extraction parameters of the new chromatograms
+    """
+    dirname: str = os.path.dirname(str(fn))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    dtype, compression = get_chromatogram_storage()
+    schema = get_chromatogram_schema(dtype)
+    batches = {key: _chromatogram_to_batch(chrom, schema) for key, chrom in chroms.items()}
+    with lock(fn, timeout=60):
+        manifest = read_chromatogram_manifest(fn)
+        if source is not None and (manifest.get("source") or {}).get("hash") != source["hash"]:
+            manifest = {}
+        stored = list(read_chromatogram_index(fn)) if manifest or source is None else []
+        stored_params = manifest.get("params", {})
+        stored_params = {key: stored_params.get(key) for key in stored}
+        stored_params.update({key: params for key in chroms})
+        keys = list(stored_params)
+        keep = [key for key in stored if key not in chroms]
+        manifest = {
+            "version": CHROMATOGRAM_STORE_VERSION,
+            "source": source if source is not None else manifest.get("source"),
+            "params": stored_params,
+        }
+        schema = schema.with_metadata(
+            {"index": json.dumps(keys), "manifest": json.dumps(manifest)}
+        )
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        fn_tmp = f"{fn}.tmp"
+        with pa.OSFile(fn_tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, schema, options=options) as writer:
+                # Stored chromatograms are copied as record batches without
+                # converting them to DataFrames, the memory map stays open
+                # until they are written
+                with pa.memory_map(str(fn), "r") if keep else nullcontext() as source_file:
+                    if keep:
+                        reader = pa.ipc.open_file(source_file)
+                        for i, key in enumerate(stored):
+                            if key in batches:
+                                continue
+                            batch = reader.get_batch(i)
+                            if not batch.schema.equals(schema, check_metadata=False):
+                                batch = _chromatogram_to_batch(_batch_to_chromatogram(batch), schema)
+                            batches[key] = batch
+                    for key in keys:
+                        writer.write_batch(batches[key])
+        os.replace(fn_tmp, fn)
+
+
+CHROMATOGRAM_DTYPES = ("float32", "float64")
+CHROMATOGRAM_COMPRESSIONS = ("zstd", "lz4", "none")
+
+
+def get_chromatogram_storage():
+    """
+    Returns the storage dtype and IPC compression of chromatogram
+    stores set with `--chromatogram-dtype` and
+    `--chromatogram-compression`.
+
+    With dtype 'float32' the intensities are stored as float32 and
+    the scan times as integer milliseconds. With 'float64' both are
+    stored without loss.
+
+    Returns:
+        tuple: (dtype, compression) where compression is None for
+               uncompressed stores
+    """
+    dtype = os.getenv("MINT_CHROMATOGRAM_DTYPE") or "float32"
+    compression = os.getenv("MINT_CHROMATOGRAM_COMPRESSION") or "zstd"
+    if dtype not in CHROMATOGRAM_DTYPES:
+        raise ValueError(f"Unknown chromatogram dtype {dtype}.")
+    if compression not in CHROMATOGRAM_COMPRESSIONS:
+        raise ValueError(f"Unknown chromatogram compression {compression}.")
+    if compression == "none":
+        compression = None
+    elif not pa.Codec.is_available(compression):
+        logging.warning(f"Compression {compression} not available, writing uncompressed.")
+        compression = None
+    return dtype, compression
+
+
+def get_chromatogram_schema(dtype="float32"):
+    """Returns the Arrow schema of the chromatograms in a store."""
+    if dtype == "float64":
+        return pa.schema([("scan_time", pa.float64()), ("intensity", pa.float64())])
+    # Scan times are rounded to milliseconds by resample_chromatogram()
+    return pa.schema([("scan_time", pa.int32()), ("intensity", pa.float32())])
+
+
+def _chromatogram_to_batch(chrom, schema):
+    scan_time = chrom["scan_time"].to_numpy(dtype=np.float64)
+    if pa.types.is_integer(schema.field("scan_time").type):
+        scan_time = np.round(scan_time * 1000)
+    return pa.record_batch(
+        [
+            pa.array(scan_time.astype(schema.field("scan_time").type.to_pandas_dtype())),
+            pa.array(
+                chrom["intensity"].to_numpy(
+                    dtype=schema.field("intensity").type.to_pandas_dtype()
+                )
+            ),
+        ],
+        schema=schema,
+    )
+
+
+def _scan_time_to_numpy(column):
+    # Integer scan times are stored in milliseconds
+    scan_time = column.to_numpy(zero_copy_only=False)
+    if pa.types.is_integer(column.type):
+        scan_time = scan_time / 1000
+    return scan_time
+
+
+def read_chromatogram_manifest(fn: Union[str, pathlib.Path]) -> dict:
+    """Return the manifest of a chromatogram store, empty if there is none."""
+    if not os.path.isfile(fn):
+        return {}
+    with pa.memory_map(str(fn), "r") as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    if b"manifest" not in metadata:
+        return {}
+    return json.loads(metadata[b"manifest"])
+
+
+def get_chromatogram_params(time_step: float = 0.25) -> dict:
+    """Return the extraction parameters recorded for each chromatogram."""
+    return {"time_step": float(time_step)}
+
+
+def get_ms_file_fingerprint(ms_file) -> dict:
+    """
+    Fingerprint of an MS file for the validation of derived data.
+
+    The hash covers the size and the first and last MiB of the file,
+    which is enough to recognize a replaced file without reading
+    the complete file.
+
+    Returns:
+        dict: with keys 'size', 'mtime_ns' and 'hash'
+    """
+    stat = os.stat(ms_file)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": _quick_file_hash(os.path.abspath(ms_file), stat.st_size, stat.st_mtime_ns),
+    }
+
+
+@lru_cache(maxsize=4096)
+def _quick_file_hash(fn, size, mtime_ns, chunk_size=2**20):
+    # size and mtime_ns are part of the cache key
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(fn, "rb") as file:
+        digest.update(file.read(chunk_size))
+        if size > chunk_size:
+            file.seek(max(chunk_size, size - chunk_size))
+            digest.update(file.read(chunk_size))
+    return digest.hexdigest()
+
+
+_VALID_CHROMATOGRAM_STORES = {}
+
+
+def validate_chromatogram_store(fn_store, ms_file) -> bool:
+    """
+    Remove a chromatogram store that does not match its MS file.
+
+    A store is valid if size and modification time of the MS file
+    match the manifest. Otherwise, the quick hash of the file is
+    compared, so that copies of the same file keep their
+    chromatograms. Stores without manifest are removed as well.
+
+    Returns:
+        bool: True if the store exists and is valid
+    """
+    if not os.path.isfile(fn_store) or not os.path.isfile(ms_file):
+        return False
+    stat = os.stat(ms_file)
+    memo_key = (
+        os.path.abspath(fn_store),
+        os.stat(fn_store).st_mtime_ns,
+        os.path.abspath(ms_file),
+        stat.st_size,
+        stat.st_mtime_ns,
+    )
+    if memo_key in _VALID_CHROMATOGRAM_STORES:
+        return True
+    try:
+        manifest = read_chromatogram_manifest(fn_store)
+    except Exception:
+        logging.warning(f"Could not read {fn_store}.")
+        manifest = {}
+    source = manifest.get("source") or {}
+    valid = manifest.get("version") == CHROMATOGRAM_STORE_VERSION and (
+        (source.get("size"), source.get("mtime_ns")) == (stat.st_size, stat.st_mtime_ns)
+        or source.get("hash") == get_ms_file_fingerprint(ms_file)["hash"]
+    )
+    if not valid:
+        logging.info(f"Removing outdated chromatograms {fn_store}.")
+        with lock(fn_store, timeout=60):
+            if os.path.isfile(fn_store):
+                os.remove(fn_store)
+        return False
+    if len(_VALID_CHROMATOGRAM_STORES) > 10000:
+        _VALID_CHROMATOGRAM_STORES.clear()
+    _VALID_CHROMATOGRAM_STORES[memo_key] = True
+    return True
+
+
+def read_chromatogram_index(fn: Union[str, pathlib.Path]) -> dict:
+    """Return the mapping of chromatogram keys to record batches of a store."""
+    if not os.path.isfile(fn):
+        return {}
+    with pa.memory_map(str(fn), "r") as source:
+        schema = pa.ipc.open_file(source).schema
+    keys = json.loads(schema.metadata[b"index"])
+    return {key: i for i, key in enumerate(keys)}
+
+
+def read_chromatogram(
+    fn: Union[str, pathlib.Path],
+    key: str,
+    params: Optional[dict] = None,
+    rt_min: Optional[float] = None,
+    rt_max: Optional[float] = None,
+) -> Optional[pd.DataFrame]:
+    """
+    Read a single chromatogram from a store, returns None if it is
+    missing or, if `params` are given, was extracted with different
+    parameters.
+
+    With `rt_min` and/or `rt_max` only the scans inside the RT window
+    (inclusive) are returned. The window is located by binary search on
+    the sorted scan times of the record batch, and only the slice is
+    converted to a DataFrame. The batch itself is read completely,
+    compressed stores are decompressed as a whole.
+    """
+    if not os.path.isfile(fn):
+        return None
+    with pa.memory_map(str(fn), "r") as source:
+        reader = pa.ipc.open_file(source)
+        keys = json.loads(reader.schema.metadata[b"index"])
+        if key not in keys:
+            return None
+        if params is not None:
+            manifest = json.loads(reader.schema.metadata.get(b"manifest", b"{}"))
+            if manifest.get("params", {}).get(key) != params:
+                return None
+        batch = reader.get_batch(keys.index(key))
+        if rt_min is not None or rt_max is not None:
+            batch = _slice_batch_by_scan_time(batch, rt_min, rt_max)
+        return _batch_to_chromatogram(batch)
+
+
+def _slice_batch_by_scan_time(batch, rt_min=None, rt_max=None):
+    # Zero-copy for uncompressed float64 stores, otherwise the scan
+    # times are decompressed or converted from milliseconds first
+    scan_time = _scan_time_to_numpy(batch.column("scan_time"))
+    start, stop = get_rt_window_bounds(scan_time, rt_min, rt_max)
+    return batch.slice(start, stop - start)
+
+
+def get_rt_window_bounds(scan_time, rt_min=None, rt_max=None):
+    """
+    Return the start and stop index of the scans of a sorted array
+    of scan times within [rt_min, rt_max]. Missing bounds (None or NaN)
+    are treated as open.
+    """
+    start, stop = 0, len(scan_time)
+    if rt_min is not None and not pd.isna(rt_min):
+        start = int(np.searchsorted(scan_time, rt_min, side="left"))
+    if rt_max is not None and not pd.isna(rt_max):
+        stop = int(np.searchsorted(scan_time, rt_max, side="right"))
+    return start, max(start, stop)
+
+
+def read_chromatograms(fn: Union[str, pathlib.Path]) -> dict:
+    """Read all chromatograms of a store."""
+    if not os.path.isfile(fn):
+        return {}
+    with pa.memory_map(str(fn), "r") as source:
+        reader = pa.ipc.open_file(source)
+        keys = json.loads(reader.schema.metadata[b"index"])
+        return {
+            key: _batch_to_chromatogram(reader.get_batch(i))
+            for i, key in enumerate(keys)
+        }
+
+
+def _batch_to_chromatogram(batch):
+    # Copy the data so that the memory map can be released
+    return pd.DataFrame(
+        {
+            "scan_time": np.array(_scan_time_to_numpy(batch.column("scan_time")), dtype=np.float64),
+            "intensity": np.array(batch.column("intensity"), dtype=np.float64),
+        }
+    )
+
+
+def create_chromatogram(
+    ms_file: Union[str, pathlib.Path],
+    mz_mean: float,
+    mz_width: float,
+    fn_out: Union[str, pathlib.Path],
+    time_step: float = 0.25
+) -> pd.DataFrame:
+    """
+    Create a chromatogram from mass spectrometry data.
+    
+    Args:
+        ms_file: Path to the mass spectrometry file
+        mz_mean: Mean m/z value for filtering
+        mz_width: Width of m/z window in ppm
+        fn_out: Filename of the chromatogram store
+        time_step: Time step for equidistant time points (default: 0.25)
+        
+    Returns:
+        pd.DataFrame: Processed chromatogram data with equidistant time points
+                     Returns empty DataFrame if no data is found
+    """
+    
+    mz_mean, mz_width = get_chromatogram_window(mz_mean, mz_width)
+    key = get_chromatogram_key(mz_mean, mz_width)
+    windows = pd.DataFrame({"mz_mean": [mz_mean], "mz_width": [mz_width], "key": [key]})
+    return create_chromatograms_for_windows(ms_file, windows, fn_out, time_step=time_step)[key]
+
+
+def create_chromatograms_for_windows(ms_file, windows, fn_out, time_step=0.25) -> dict:
+    """
+    Create the chromatograms of many m/z windows of one MS file.
+
+    The MS file is read once, and all chromatograms are added to
+    the store in a single write.
+
+    Args:
+        ms_file: Path to the mass spectrometry file
+        windows: Canonical windows with columns 'mz_mean', 'mz_width'
+                 and 'key', see `get_target_windows()`
+        fn_out: Filename of the chromatogram store
+        time_step: Time step for equidistant time points (default: 0.25)
+
+    Returns:
+        dict: Chromatograms by key as they will be read from the store
+    """
+    chroms = extract_chromatograms_from_ms_file(
+        ms_file, windows["mz_mean"].values, windows["mz_width"].values
+    )
+    schema = get_chromatogram_schema(get_chromatogram_storage()[0])
+    chroms = {
+        key: _batch_to_chromatogram(
+            _chromatogram_to_batch(resample_chromatogram(chrom, time_step=time_step), schema)
+        )
+        for key, chrom in zip(windows["key"], chroms)
+    }
+    write_chromatograms(
+        fn_out,
+        chroms,
+        source=get_ms_file_fingerprint(ms_file),
+        params=get_chromatogram_params(time_step),
+    )
+    return chroms
+
+
+def get_chromatogram(
+    ms_file, mz_mean, mz_width, wdir, time_step=0.25, rt_min=None, rt_max=None
+):
+    mz_mean, mz_width = get_chromatogram_window(mz_mean, mz_width)
+    fn = get_chromatogram_store_fn(ms_file, wdir)
+    key = get_chromatogram_key(mz_mean, mz_width)
+    try:
+        validate_chromatogram_store(fn, ms_file)
+        chrom = read_chromatogram(
+            fn,
+            key,
+            params=get_chromatogram_params(time_step),
+            rt_min=rt_min,
+            rt_max=rt_max,
+        )
+    except (ValueError, KeyError):
+        # Corrupt store (pa.ArrowInvalid and invalid JSON are ValueErrors)
+        logging.warning(f"Could not read {fn}, removing it.")
+        with lock(fn, timeout=60):
+            if os.path.isfile(fn):
+                os.remove(fn)
+        chrom = None
+    if chrom is None:
+        # Create the missing chromatograms of all targets of the workspace
+        # along with the requested one, so that the store is written once
+        # instead of once per target
+        targets = get_targets(wdir).reset_index()
+        windows = Chromatograms(wdir, targets, [ms_file])._get_missing_windows(
+            ms_file, get_target_windows(targets).drop_duplicates("key"), time_step
+        )
+        requested = pd.DataFrame({"mz_mean": [mz_mean], "mz_width": [mz_width], "key": [key]})
+        windows = pd.concat([windows[windows["key"] != key], requested], ignore_index=True)
+        chroms = create_chromatograms_for_windows(ms_file, windows, fn, time_step=time_step)
+        chrom = chroms[key]
+        start, stop = get_rt_window_bounds(chrom["scan_time"].values, rt_min, rt_max)
+        chrom = chrom.iloc[start:stop].reset_index(drop=True)
+    return chrom
+
+
+def get_chromatogram_matrix(
+    ms_files, mz_mean, mz_width, wdir, time_step=0.25, rt_min=None, rt_max=None
+):
+    """
+    Get the chromatograms of one target for many MS files
+    resampled onto a common time grid.
+
+    The matrix is cached in the workspace and rebuilt when the
+    list of files changes or one of their chromatograms is
+    newer than the cached matrix. If an RT window is given, the
+    matrix is cut to the window. Without a valid cached matrix, the
+    chromatograms are cut to the window before they are resampled
+    and the result is not cached.
+
+    Args:
+        ms_files: Paths to the MS files
+        mz_mean: Mean m/z value of the target
+        mz_width: Width of m/z window in ppm
+        wdir: Workspace directory
+        time_step: Time step of the common grid (default: 0.25)
+        rt_min: Lower bound of the RT window (optional)
+        rt_max: Upper bound of the RT window (optional)
+
+    Returns:
+        tuple: (time_points, intensities) where intensities is a
+               float32 array with one row per MS file and one
+               column per time point
+    """
+    labels = np.array([filename_to_label(fn) for fn in ms_files])
+    fn = get_chromatogram_matrix_fn(mz_mean, mz_width, wdir)
+    windowed = rt_min is not None or rt_max is not None
+
+    cached = _read_chromatogram_matrix(fn, ms_files, labels, time_step, wdir)
+    if cached is not None:
+        time_points, intensities = cached
+        if windowed:
+            start, stop = get_rt_window_bounds(time_points, rt_min, rt_max)
+            time_points, intensities = time_points[start:stop], intensities[:, start:stop]
+        return time_points, intensities
+
+    chroms = [
+        get_chromatogram(ms_file, mz_mean, mz_width, wdir, rt_min=rt_min, rt_max=rt_max)
+        for ms_file in ms_files
+    ]
+    time_points, intensities = resample_chromatograms_to_common_grid(
+        chroms, time_step=time_step
+    )
+    if windowed:
+        return time_points, intensities
+
+    maybe_create(os.path.dirname(fn))
+    with lock(fn, timeout=60):
+        fn_tmp = f"{fn}.tmp"
+        with open(fn_tmp, "wb") as file:
+            np.savez(
+                file,
+                labels=labels,
+                time_step=time_step,
+                time_points=time_points,
+                intensities=intensities,
+            )
+        os.replace(fn_tmp, fn)
+    return time_points, intensities
+
+
+def _read_chromatogram_matrix(fn, ms_files, labels, time_step, wdir):
+    # Returns None if there is no valid cached matrix
+    if not os.path.isfile(fn):
+        return None
+    mtime = os.path.getmtime(fn)
+    try:
+        with np.load(fn) as cached:
+            if (
+                np.array_equal(cached["labels"], labels)
+                and cached["time_step"] == time_step
+                and all(
+                    validate_chromatogram_store(fn_store, ms_file)
+                    and os.path.getmtime(fn_store) <= mtime
+                    for fn_store, ms_file in (
+                        (get_chromatogram_store_fn(ms_file, wdir), ms_file)
+                        for ms_file in ms_files
+                    )
+                )
+            ):
+                return cached["time_points"], cached["intensities"]
+    except Exception:
+        logging.warning(f"Could not read {fn}.")
+    return None
+
+
+def resample_chromatograms_to_common_grid(chroms, time_step=0.25):
+    """
+    Interpolate chromatograms onto one equidistant time grid
+    spanning all of them. Intensities outside the time range
+    of a chromatogram are set to zero.
+
+    Returns:
+        tuple: (time_points, intensities) with a float32 array
+               of shape (number of chromatograms, time points)
+    """
+    chroms = list(chroms)
+    scan_times = [
+        chrom["scan_time"].to_numpy(dtype=np.float64)
+        for chrom in chroms
+        if chrom is not None and len(chrom) > 0
+    ]
+    if len(scan_times) == 0:
+        return np.array([]), np.zeros((len(chroms), 0), dtype=np.float32)
+
+    start_time = np.floor(min(x.min() for x in scan_times) / time_step) * time_step
+    end_time = max(x.max() for x in scan_times)
+    time_points = np.arange(start_time, end_time + time_step, time_step).round(3)
+
+    intensities = np.zeros((len(chroms), len(time_points)), dtype=np.float32)
+    for i, chrom in enumerate(chroms):
+        if chrom is None or len(chrom) == 0:
+            continue
+        intensities[i] = np.interp(
+            time_points,
+            chrom["scan_time"].to_numpy(dtype=np.float64),
+            chrom["intensity"].to_numpy(dtype=np.float64),
+            left=0,
+            right=0,
+        )
+    return time_points, intensities
+
+
+def get_chromatogram_matrix_fn(mz_mean, mz_width, wdir):
+    key = get_chromatogram_key(mz_mean, mz_width)
+    return os.path.join(wdir, "chromato", "matrix", f"{key}.npz")
+
+
+MS_CATALOG_COLUMNS = [
+    "ms_file_label",
+    "ms_file",
+    "file_size",
+    "mtime_ns",
+    "n_scans",
+    "n_points",
+    "scan_time_min",
+    "scan_time_max",
+    "mz_min",
+    "mz_max",
+    "ms_levels",
+    "polarities",
+    "content_hash",
+    "source_hash",
+    "error",
+]
+
+MS_CATALOG_TRACE_COLUMNS = ["tic_scan_time", "tic", "bpc"]
+
+
+def get_ms_catalog_fn(wdir):
+    return os.path.join(wdir, "ms_catalog.parquet")
+
+
+def summarize_ms_file(fn) -> dict:
+    """
+    Compute the catalog entry of an MS file.
+
+    Feather files are read one record batch at a time, other
+    formats are read completely.
+
+    Returns:
+        dict: with number of scans and data points, ranges of
+              scan time and m/z, MS levels, polarities, file size,
+              modification time and content hash, and the total ion chromatogram
+              (TIC) and base peak chromatogram (BPC) of the MS1 scans
+    """
+    scan_ids, ms_levels, polarities = set(), set(), set()
+    n_points = 0
+    scan_time = [np.inf, -np.inf]
+    mz = [np.inf, -np.inf]
+    traces = []
+    for batch in _iter_ms_file_batches(fn):
+        if batch.num_rows == 0:
+            continue
+        n_points += batch.num_rows
+        scan_ids.update(np.unique(batch.column("scan_id").to_numpy()).tolist())
+        ms_levels.update(np.unique(batch.column("ms_level").to_numpy()).tolist())
+        polarities.update(x for x in batch.column("polarity").unique().to_pylist() if x)
+        for values, column in [(scan_time, "scan_time"), (mz, "mz")]:
+            column = batch.column(column).to_numpy(zero_copy_only=False)
+            values[0] = min(values[0], float(column.min()))
+            values[1] = max(values[1], float(column.max()))
+        ms1 = batch.column("ms_level").to_numpy(zero_copy_only=False) == 1
+        traces.append(
+            (
+                batch.column("scan_time").to_numpy(zero_copy_only=False)[ms1],
+                batch.column("intensity").to_numpy(zero_copy_only=False)[ms1],
+            )
+        )
+    if n_points == 0:
+        scan_time = mz = [None, None]
+    tic_scan_time, tic, bpc = _ion_chromatograms(traces)
+    stat = os.stat(fn)
+    return {
+        "ms_file_label": filename_to_label(fn),
+        "ms_file": os.path.basename(fn),
+        "file_size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "n_scans": len(scan_ids),
+        "n_points": n_points,
+        "scan_time_min": scan_time[0],
+        "scan_time_max": scan_time[1],
+        "mz_min": mz[0],
+        "mz_max": mz[1],
+        "ms_levels": ",".join(str(x) for x in sorted(ms_levels)),
+        "polarities": ",".join(sorted(polarities)),
+        "content_hash": hash_file(fn),
+        "source_hash": None,
+        "tic_scan_time": tic_scan_time,
+        "tic": tic,
+        "bpc": bpc,
+    }
+
+
+def _iter_ms_file_batches(fn):
+    if str(fn).lower().endswith(".feather"):
+        with pa.memory_map(str(fn), "r") as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield _normalize_ms_file_batch(reader.get_batch(i))
+    else:
+        df = read_ms_file(fn)
+        yield _normalize_ms_file_batch(pa.RecordBatch.from_pandas(df, preserve_index=False))
+
+
+# Column names of files converted by older versions
+MS_FILE_LEGACY_COLUMNS = {
+    "retentionTime": "scan_time",
+    "m/z array": "mz",
+    "intensity array": "intensity",
+}
+
+
+def _normalize_ms_file_batch(batch):
+    # Same defaults as ms_mint.io.ms_file_to_df(), files without
+    # polarity have none
+    names = [MS_FILE_LEGACY_COLUMNS.get(x, x) for x in batch.schema.names]
+    columns = dict(zip(names, batch.columns))
+    defaults = [("scan_id", 0, pa.int64()), ("ms_level", 1, pa.int8()), ("polarity", None, pa.string())]
+    for name, value, dtype in defaults:
+        if name not in columns:
+            columns[name] = pa.array([value] * batch.num_rows, type=dtype)
+    return pa.RecordBatch.from_arrays(list(columns.values()), names=list(columns))
+
+
+def _ion_chromatograms(traces):
+    # Scans can span record batches, so they are reduced again at the end
+    if len(traces) == 0:
+        return np.array([], np.float32), np.array([]), np.array([])
+    scan_time = np.concatenate([x[0] for x in traces]).astype(np.float32)
+    intensity = np.concatenate([x[1] for x in traces]).astype(np.float64)
+    scan_time, inverse = np.unique(scan_time, return_inverse=True)
+    tic = np.zeros(len(scan_time))
+    bpc = np.zeros(len(scan_time))
+    np.add.at(tic, inverse, intensity)
+    np.maximum.at(bpc, inverse, intensity)
+    return scan_time, tic, bpc
+
+
+def update_ms_catalog(wdir, ms_files=None, source_hashes=None, entries=None):
+    """
+    Add or refresh entries of the MS file catalog of a workspace.
+
+    The catalog is a Parquet file with one row per MS file holding
+    the summary from `summarize_ms_file()`. Entries of files that
+    no longer exist are removed.
+
+    Args:
+        wdir: Workspace directory
+        ms_files: Files to (re-)catalog, by default all feather files
+                  that are missing in the catalog or changed since,
+                  except those still prepared by `MS_FILE_QUEUE`
+        source_hashes: Content hashes of the files the MS files were
+                       converted from, default to the hashes of the
+                       MS files themselves
+        entries: Ready-made catalog entries to add
+
+    Returns:
+        pd.DataFrame: The updated catalog
+    """
+    fn = get_ms_catalog_fn(wdir)
+    if ms_files is None:
+        catalog = _read_ms_catalog(fn, columns=MS_CATALOG_COLUMNS)
+        pending = {filename_to_label(x) for x in MS_FILE_QUEUE.pending_files()}
+        ms_files = [
+            x
+            for x in get_ms_fns(wdir)
+            if x.lower().endswith(".feather")
+            and filename_to_label(x) not in pending
+            and not _is_cataloged(catalog, x)
+        ]
+    source_hashes = source_hashes or {}
+    # Summarize outside of the lock, so that workers do not wait for each other
+    entries = list(entries or [])
+    for ms_file in ms_files:
+        try:
+            entry = summarize_ms_file(ms_file)
+        except Exception as e:
+            # Recorded, so that unreadable files are not read again until they change
+            logging.warning(f"Could not catalog {ms_file}: {e}")
+            entry = _unreadable_ms_catalog_entry(ms_file, e)
+        entry["source_hash"] = source_hashes.get(ms_file)
+        entries.append(entry)
+    with lock(fn, timeout=60):
+        catalog = _read_ms_catalog(fn)
+        existing = [filename_to_label(x) for x in get_ms_fns(wdir)]
+        catalog = catalog[catalog.ms_file_label.isin(existing)]
+        if len(entries) > 0:
+            new = pd.DataFrame(entries, columns=MS_CATALOG_COLUMNS + MS_CATALOG_TRACE_COLUMNS)
+            # Keep the source of files with unchanged content
+            known_sources = dict(zip(catalog.content_hash, catalog.source_hash))
+            new["source_hash"] = [
+                source or known_sources.get(content) or content
+                for source, content in zip(new.source_hash, new.content_hash)
+            ]
+            catalog = catalog[~catalog.ms_file_label.isin(new.ms_file_label)]
+            catalog = pd.concat([catalog, new], ignore_index=True) if len(catalog) > 0 else new
+        catalog = catalog.sort_values("ms_file_label").reset_index(drop=True)
+        fn_tmp = f"{fn}.tmp"
+        catalog.to_parquet(fn_tmp, index=False)
+        os.replace(fn_tmp, fn)
+    return catalog
+
+
+def _unreadable_ms_catalog_entry(fn, error):
+    stat = os.stat(fn)
+    return {
+        "ms_file_label": filename_to_label(fn),
+        "ms_file": os.path.basename(fn),
+        "file_size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "content_hash": hash_file(fn),
+        "error": f"{type(error).__name__}: {error}",
+    }
+
+
+def _read_ms_catalog(fn, columns=None):
+    columns = columns or MS_CATALOG_COLUMNS + MS_CATALOG_TRACE_COLUMNS
+    if not os.path.isfile(fn):
+        return pd.DataFrame(columns=columns)
+    if set(columns) <= set(MS_CATALOG_COLUMNS):
+        # The scalar columns are mirrored in the workspace database
+        wdir, key = os.path.dirname(fn), get_file_key(fn)
+        catalog = read_workspace_table(wdir, "ms_catalog", key)
+        if catalog is None:
+            catalog = _read_ms_catalog_file(fn, MS_CATALOG_COLUMNS)
+            write_workspace_table(wdir, "ms_catalog", catalog, key, indexes=["ms_file_label"])
+        return catalog[columns]
+    return _read_ms_catalog_file(fn, columns)
+
+
+def _read_ms_catalog_file(fn, columns):
+    # Catalogs of older versions can lack columns
+    available = pq.read_schema(fn).names
+    catalog = pd.read_parquet(fn, columns=[x for x in columns if x in available])
+    return catalog.reindex(columns=columns)
+
+
+def _is_cataloged(catalog, ms_file):
+    stat = os.stat(ms_file)
+    entry = catalog[catalog.ms_file_label == filename_to_label(ms_file)]
+    return (
+        len(entry) == 1
+        and entry.ms_file.iloc[0] == os.path.basename(ms_file)
+        and entry.file_size.iloc[0] == stat.st_size
+        and entry.mtime_ns.iloc[0] == stat.st_mtime_ns
+        and pd.notna(entry.content_hash.iloc[0])
+    )
+
+
+_MS_CATALOG_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+_MS_CATALOG_UPDATES = {}
+_MS_CATALOG_UPDATES_LOCK = threading.Lock()
+
+
+def get_ms_catalog(wdir, traces=False):
+    """
+    Returns the MS file catalog of a workspace.
+
+    The catalog is filled by the upload queue, the import and the
+    conversion of MS files, it is never updated in the calling
+    thread. When the MS file index of the workspace changed, missing
+    and outdated entries are refreshed in the background, see
+    `wait_for_ms_catalog()`, failed updates are retried on the next
+    call. Files without entry are returned with empty summaries,
+    files that could not be read with the reason in the error column.
+
+    Args:
+        wdir: Workspace directory
+        traces: Also return the TIC/BPC columns
+
+    Returns:
+        pd.DataFrame: one row per MS file
+    """
+    columns = MS_CATALOG_COLUMNS + (MS_CATALOG_TRACE_COLUMNS if traces else [])
+    fns = tuple(get_ms_file_index(wdir).fns)
+    key = os.path.abspath(wdir)
+    with _MS_CATALOG_UPDATES_LOCK:
+        previous = _MS_CATALOG_UPDATES.get(key)
+        failed = previous is not None and previous[1].done() and not previous[1].result()
+        if previous is None or previous[0] != fns or failed:
+            future = _MS_CATALOG_EXECUTOR.submit(_update_ms_catalog_in_background, wdir)
+            _MS_CATALOG_UPDATES[key] = (fns, future)
+    catalog = _read_ms_catalog(get_ms_catalog_fn(wdir), columns=columns)
+    files = pd.DataFrame(
+        {
+            "ms_file_label": [filename_to_label(fn) for fn in fns],
+            "ms_file": [os.path.basename(fn) for fn in fns],
+        }
+    )
+    return files.merge(catalog, on=["ms_file_label", "ms_file"], how="left")[columns]
+
+
+def _update_ms_catalog_in_background(wdir):
+    try:
+        update_ms_catalog(wdir)
+        return True
+    except Exception as e:
+        logging.warning(f"Could not update the MS file catalog of {wdir}: {e}")
+        return False
+
+
+def wait_for_ms_catalog(wdir):
+    """Block until the background update of the MS file catalog is done."""
+    with _MS_CATALOG_UPDATES_LOCK:
+        update = _MS_CATALOG_UPDATES.get(os.path.abspath(wdir))
+    if update is not None:
+        update[1].result()
+
+
+def check_targets_against_ms_catalog(targets, wdir):
+    """
+    Find targets outside the m/z or scan time range of all MS files.
+
+    Returns:
+        list: Messages, one per problematic target
+    """
+    catalog = get_ms_catalog(wdir)
+    if len(catalog) == 0 or len(targets) == 0:
+        return []
+    mz_min, mz_max = catalog.mz_min.min(), catalog.mz_max.max()
+    rt_min, rt_max = catalog.scan_time_min.min(), catalog.scan_time_max.max()
+    messages = []
+    for _, target in targets.iterrows():
+        label = target.get("peak_label")
+        mz_mean = pd.to_numeric(target.get("mz_mean"), errors="coerce")
+        if pd.notna(mz_mean) and not mz_min <= mz_mean <= mz_max:
+            messages.append(
+                f"{label}: m/z {mz_mean} outside the m/z range of the MS files ({mz_min:.4f}-{mz_max:.4f})."
+            )
+        t_min = pd.to_numeric(target.get("rt_min"), errors="coerce")
+        t_max = pd.to_numeric(target.get("rt_max"), errors="coerce")
+        if pd.notna(t_min) and pd.notna(t_max) and (t_max < rt_min or t_min > rt_max):
+            messages.append(
+                f"{label}: RT window {t_min}-{t_max} outside the scan times of the MS files ({rt_min:.1f}-{rt_max:.1f})."
+            )
+    return messages
+
+
+def hash_file(fn, chunk_size=2**20) -> str:
+    """Returns the BLAKE2b hash of the content of a file, read in chunks."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(fn, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_duplicate_ms_file(source_hash, wdir) -> Optional[str]:
+    """
+    Returns the MS file of the workspace that was converted from, or
+    is identical to, a file with the given content hash.
+    """
+    catalog = _read_ms_catalog(
+        get_ms_catalog_fn(wdir), columns=["ms_file", "content_hash", "source_hash"]
+    )
+    match = catalog[(catalog.source_hash == source_hash) | (catalog.content_hash == source_hash)]
+    for ms_file in match.ms_file:
+        fn = os.path.join(get_ms_dirname(wdir), ms_file)
+        if os.path.isfile(fn):
+            return fn
+    return None
+
+
+def _replace_with_link(src, dst, touch=False):
+    """
+    Atomically replace dst by a hard link to, or a copy of, src.
+
+    When src does not exist, dst is removed. With touch, the
+    modification time of a replaced dst is updated, which also
+    updates src when they are linked.
+    """
+    replaced = os.path.exists(dst)
+    if not os.path.isfile(src):
+        if replaced:
+            os.remove(dst)
+        return
+    dst_tmp = f"{dst}.tmp"
+    if os.path.exists(dst_tmp):
+        os.remove(dst_tmp)
+    try:
+        os.link(src, dst_tmp)
+    except OSError:
+        shutil.copy2(src, dst_tmp)
+    os.replace(dst_tmp, dst)
+    if replaced and touch:
+        os.utime(dst)
+
+
+def link_ms_file(fn_src, fn_dst, wdir):
+    """
+    Add a duplicate of an MS file of the workspace under a new name.
+
+    The file, its chromatograms and m/z sorted copy are hard linked
+    where the file system allows it and copied otherwise, and the
+    catalog entry is copied, so nothing is converted or extracted
+    twice. Existing files under the new name are replaced atomically,
+    and derived files the source does not have are removed.
+    """
+    pairs = [
+        (fn_src, fn_dst),
+        (get_chromatogram_store_fn(fn_src, wdir), get_chromatogram_store_fn(fn_dst, wdir)),
+        (get_mz_sorted_fn(fn_src), get_mz_sorted_fn(fn_dst)),
+    ]
+    for src, dst in pairs:
+        if os.path.isfile(dst) and os.path.isfile(src) and os.path.samefile(src, dst):
+            continue
+        if dst != pairs[1][1]:
+            _replace_with_link(src, dst)
+            continue
+        # Stores are written under a lock, and cached chromatogram
+        # matrices are rebuilt only for stores newer than the matrix
+        with lock(dst, timeout=60):
+            _replace_with_link(src, dst, touch=True)
+    catalog = _read_ms_catalog(get_ms_catalog_fn(wdir))
+    entry = catalog[catalog.ms_file == os.path.basename(fn_src)]
+    if len(entry) == 0:
+        update_ms_catalog(wdir, [str(fn_dst)])
+        return
+    entry = entry.iloc[0].to_dict()
+    stat = os.stat(fn_dst)
+    entry.update(
+        ms_file_label=filename_to_label(fn_dst),
+        ms_file=os.path.basename(fn_dst),
+        file_size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+    )
+    update_ms_catalog(wdir, [], entries=[entry])
+
+
+def prepare_ms_file(fn, wdir):
+    """
+    Make an uploaded MS file ready for analysis.
+
+    Removes the empty first line left by the uploader, converts the
+    file to feather format, removes the original file and adds the
+    converted file to the MS file catalog. Files identical to one
+    that is already in the workspace are linked to it instead.
+
+    Returns:
+        str: Filename of the feather file
+    """
+    if str(fn).lower().endswith((".mzml", ".mzxml")):
+        fix_first_emtpy_line_after_upload_workaround(fn)
+    source_hash = hash_file(fn)
+    fn_out = str(P(fn).with_suffix(".feather"))
+    duplicate = find_duplicate_ms_file(source_hash, wdir)
+    linked = False
+    if duplicate is not None and duplicate != fn_out:
+        logging.info(f"{fn} is identical to {duplicate}, linking it.")
+        try:
+            link_ms_file(duplicate, fn_out, wdir)
+            linked = True
+        except OSError as e:
+            logging.warning(f"Could not link {duplicate} to {fn_out}, converting {fn}: {e}")
+    if not linked:
+        fn_out = convert_ms_file(fn)
+        update_ms_catalog(wdir, [fn_out], source_hashes={fn_out: source_hash})
+    if os.path.isfile(fn_out) and fn_out != str(fn):
+        os.remove(fn)
+    return fn_out
+
+
+class MsFileQueue:
+    """
+    Background queue for the preparation of uploaded MS files.
+
+    The files are processed by a pool of worker processes that is
+    started with the first submitted file. `submit()` returns
+    immediately.
+    """
+
+    def __init__(self, ncpu=None):
+        self.ncpu = ncpu
+        self.errors = {}
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, wdir):
+        with self._lock:
+            if self._executor is None:
+                ncpu = self.ncpu or get_ncpu() or multiprocessing.cpu_count()
+                self._executor = ProcessPoolExecutor(max_workers=ncpu, initializer=_disable_ms_file_cache)
+            future = self._executor.submit(prepare_ms_file, str(fn), wdir)
+            self._pending[future] = str(fn)
+            self.errors.pop(str(fn), None)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            fn = self._pending.pop(future)
+            if future.exception() is not None:
+                logging.warning(f"Could not prepare {fn}: {future.exception()}")
+                self.errors[fn] = str(future.exception())
+
+    def n_pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def pending_files(self):
+        with self._lock:
+            return list(self._pending.values())
+
+    def status(self, wdir):
+        """
+        Returns the pending files of a workspace and the errors of
+        files that failed and were not removed since.
+
+        Returns:
+            tuple: (list of pending files, dict of errors by file)
+        """
+        ms_dir = os.path.join(os.path.abspath(get_ms_dirname(wdir)), "")
+
+        def in_workspace(fn):
+            return os.path.abspath(fn).startswith(ms_dir)
+
+        with self._lock:
+            pending = [fn for fn in self._pending.values() if in_workspace(fn)]
+            errors = {fn: error for fn, error in self.errors.items() if in_workspace(fn)}
+        errors = {fn: error for fn, error in errors.items() if os.path.isfile(fn)}
+        return pending, errors
+
+    def wait(self):
+        """Block until all submitted files are processed."""
+        while True:
+            with self._lock:
+                futures = list(self._pending)
+            if len(futures) == 0:
+                return
+            wait(futures)
+            # Done callbacks run after waiters are notified
+            time.sleep(0.01)
+
+
+MS_FILE_QUEUE = MsFileQueue()
+
+
+def get_chromatogram_store_fn(ms_file, wdir):
+    base = filename_to_label(ms_file)
+    return os.path.join(wdir, "chromato", f"{base}.arrow")
+
+
+def get_chromatogram_window(mz_mean, mz_width):
+    """
+    Canonical m/z window of a target.
+
+    The m/z value is quantized to 0.1 mDa and the width to
+    0.1 ppm, so that targets with the same window, but slightly
+    different floating point values, share one chromatogram.
+    """
+    return round(float(mz_mean), 4), round(float(mz_width), 1)
+
+
+def get_chromatogram_key(mz_mean, mz_width):
+    mz_mean, mz_width = get_chromatogram_window(mz_mean, mz_width)
+    return f"{mz_mean:.4f}-{mz_width:.1f}"
+
+
+def get_target_windows(targets):
+    """
+    Map targets to their canonical m/z windows.
+
+    Args:
+        targets: Targets with columns 'mz_mean' and 'mz_width'
+
+    Returns:
+        pd.DataFrame: Canonical 'mz_mean', 'mz_width' and chromatogram
+                      'key' per target with the index of the targets.
+                      Targets without m/z window are dropped.
+    """
+    windows = targets[["mz_mean", "mz_width"]].dropna().astype(np.float64)
+    windows = windows.round({"mz_mean": 4, "mz_width": 1})
+    windows["key"] = [
+        get_chromatogram_key(mz_mean, mz_width)
+        for mz_mean, mz_width in windows[["mz_mean", "mz_width"]].itertuples(index=False)
+    ]
+    return windows
+
+
+def get_workspace_db_fn(wdir):
+    return os.path.join(wdir, "workspace.db")
+
+
+@contextmanager
+def workspace_db(wdir):
+    """
+    Open the SQLite database of a workspace.
+
+    The database runs in WAL mode, so readers see a consistent
+    snapshot and never block on a writer. Writers wait up to a
+    minute for each other.
+
+    The database is a read cache, not the source of truth: its tables
+    mirror the targets, metadata and MS catalog files, which are still
+    written under their file locks. A table is replaced completely
+    by the first read after its source file changed.
+
+    Args:
+        wdir: Workspace directory
+
+    Yields:
+        sqlite3.Connection: in autocommit mode
+    """
+    con = sqlite3.connect(get_workspace_db_fn(wdir), timeout=60, isolation_level=None)
+    try:
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS _sources (name TEXT PRIMARY KEY, key TEXT, dtypes TEXT)"
+        )
+        yield con
+    finally:
+        con.close()
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
 
-    def create_all_for_ms_file(self, ms_file: str):
-        fn = ms_file
-        df = ms_file_to_df(fn)
-        for ndx, row in self.targets.iterrows():
-            mz_mean, mz_width = row[["mz_mean", "mz_width"]]
-            fn_chro = get_chromatogram_fn(fn, mz_mean, mz_width, self.wdir)
-            if os.path.isfile(fn_chro):
-                continue
-            dirname = os.path.dirname(fn_chro)
-            if not os.path.isdir(dirname):
-                os.makedirs(dirname)
-            dmz = mz_mean * 1e-6 * mz_width
-            chrom = df[(df["mz"] - mz_mean).abs() <= dmz]
-            chrom["scan_time"] = chrom["scan_time"].round(3)
-            chrom = chrom.groupby("scan_time").max().reset_index()
-            chrom[["scan_time", "intensity"]].to_feather(fn_chro)
 
-    def get_single(self, mz_mean, mz_width, ms_file):
-        return get_chromatogram(ms_file, mz_mean, mz_width, self.wdir)
+def _to_sql_value(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
 
 
-def create_chromatograms(ms_files, targets, wdir):
-    for fn in tqdm(ms_files):
-        fn_out = os.path.basename(fn)
-        fn_out, _ = os.path.splitext(fn_out)
-        fn_out += ".feather"
-        for ndx, row in targets.iterrows():
-            mz_mean, mz_width = row[["mz_mean", "mz_width"]]
-            fn_chro = get_chromatogram_fn(fn, mz_mean, mz_width, wdir)
-            if not os.path.isfile(fn_chro):
-                create_chromatogram(fn, mz_mean, mz_width, fn_chro)
+def _is_nan(value):
+    return isinstance(value, float) and np.isnan(value)
 
 
-def create_chromatogram(
-    ms_file: Union[str, pathlib.Path],
-    mz_mean: float,
-    mz_width: float,
-    fn_out: Union[str, pathlib.Path],
-    time_step: float = 0.25
-) -> pd.DataFrame:
+def get_file_key(*fns):
     """
-    Create a chromatogram from mass spectrometry data.
-    
-    Args:
-        ms_file: Path to the mass spectrometry file
-        mz_mean: Mean m/z value for filtering
-        mz_width: Width of m/z window in ppm
-        fn_out: Output file path for the Feather file
-        time_step: Time step for equidistant time points (default: 0.25)
-        
-    Returns:
-        pd.DataFrame: Processed chromatogram data with equidistant time points
-                     Returns empty DataFrame if no data is found
+    JSON key of the modification time and size of files.
+    Missing files are represented by null.
     """
-    
-    # Convert MS file to DataFrame
-    df: pd.DataFrame = ms_file_to_df(ms_file)
-    
-    # Create output directory if not exists
-    dirname: str = os.path.dirname(str(fn_out))
-    if not os.path.isdir(dirname):
-        os.makedirs(dirname)
-    
-    # Calculate m/z tolerance
-    dmz: float = mz_mean * 1e-6 * mz_width
-    
-    # Filter DataFrame to specific m/z range
-    chrom: pd.DataFrame = df[(df["mz"] - mz_mean).abs() <= dmz]
-    
-    # If no data found, return empty DataFrame
-    if chrom.empty:
-        empty_result: pd.DataFrame = pd.DataFrame(columns=["scan_time", "intensity"])
-        
-        # Save empty DataFrame to Feather file
-        with lock(fn_out):
-            empty_result.to_feather(fn_out)
-            
-        return empty_result
-    
-    # Group by scan time and get max intensity
-    chrom = chrom.groupby("scan_time").max().reset_index()
-    
-    # Determine start and end times
-    start_time: float = chrom['scan_time'].min()
-    end_time: float = chrom['scan_time'].max()
-    
-    # Check if start_time or end_time is NaN
-    if np.isnan(start_time) or np.isnan(end_time):
-        empty_result: pd.DataFrame = pd.DataFrame(columns=["scan_time", "intensity"])
-        
-        # Save empty DataFrame to Feather file
-        with lock(fn_out):
-            empty_result.to_feather(fn_out)
-            
-        return empty_result
-    
-    # Create equidistant time points
-    print(start_time, end_time, time_step)
-    time_points: np.ndarray = np.arange(start_time, end_time + time_step, time_step)
-    
-    # Interpolate intensities
-    interpolated_intensities: np.ndarray = np.interp(
-        time_points, 
-        chrom['scan_time'], 
-        chrom['intensity']
-    )
-    
-    # Create new equidistant DataFrame
-    equidistant_chrom: pd.DataFrame = pd.DataFrame({
-        'scan_time': time_points,
-        'intensity': interpolated_intensities
-    })
-    
-    # Round scan time to 3 decimal places
-    equidistant_chrom['scan_time'] = equidistant_chrom['scan_time'].round(3)
-    
-    # Save to Feather file
-    with lock(fn_out):
-        equidistant_chrom[["scan_time", "intensity"]].to_feather(fn_out)
-    
-    return equidistant_chrom
+    keys = []
+    for fn in fns:
+        try:
+            stat = os.stat(fn)
+            keys.append([stat.st_mtime_ns, stat.st_size])
+        except FileNotFoundError:
+            keys.append(None)
+    return json.dumps(keys)
 
 
-def get_chromatogram(ms_file, mz_mean, mz_width, wdir):
-    fn = get_chromatogram_fn(ms_file, mz_mean, mz_width, wdir)
-    if not os.path.isfile(fn):
-        chrom = create_chromatogram(ms_file, mz_mean, mz_width, fn)
-    else:
-        try:
-            chrom = pd.read_feather(fn)
-        except:
-            os.remove(fn)
-            logging.warning(f"Cound not read {fn}.")
-            return None
+def write_workspace_table(wdir, name, df, key, indexes=()):
+    """
+    Replace a table of the workspace database.
 
-    chrom = chrom.rename(
-        columns={
-            "retentionTime": "scan_time",
-            "intensity array": "intensity",
-            "m/z array": "mz",
-        }
+    Args:
+        wdir: Workspace directory
+        name: Table name
+        df: Content of the table, the index is not stored
+        key: Identifies the state of the source of the table,
+             see `read_workspace_table`
+        indexes: Columns to index
+    """
+    columns = [str(col) for col in df.columns]
+    dtypes = {col: str(dtype) for col, dtype in zip(columns, df.dtypes)}
+    for col, values in zip(columns, df.items()):
+        # SQLite has a single NULL, remember which one object columns used
+        if dtypes[col] == "object" and values[1].map(_is_nan).any():
+            dtypes[col] = "object:nan"
+    rows = (
+        tuple(_to_sql_value(value) for value in row)
+        for row in df.itertuples(index=False, name=None)
     )
+    table = _quote(name)
+    with workspace_db(wdir) as con:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            con.execute(f"DROP TABLE IF EXISTS {table}")
+            con.execute(f"CREATE TABLE {table} ({', '.join(map(_quote, columns))})")
+            if columns:
+                con.executemany(
+                    f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})", rows
+                )
+            for col in indexes:
+                con.execute(
+                    f"CREATE INDEX {_quote(f'{name}_{col}')} ON {table} ({_quote(col)})"
+                )
+            con.execute(
+                "INSERT OR REPLACE INTO _sources VALUES (?, ?, ?)",
+                (name, key, json.dumps(dtypes)),
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+
+
+def read_workspace_table(wdir, name, key, where=None, params=()):
+    """
+    Read a table of the workspace database.
 
-    return chrom
-
+    Args:
+        wdir: Workspace directory
+        name: Table name
+        key: Expected key of the table, the table is only
+             returned if it was written with the same key
+        where: Optional SQL condition, e.g. 'peak_label IN (?, ?)'
+        params: Parameters of the condition
 
-def get_chromatogram_fn(ms_file, mz_mean, mz_width, wdir):
-    ms_file = os.path.basename(ms_file)
-    base, _ = os.path.splitext(ms_file)
-    fn = (
-        os.path.join(wdir, "chromato", f"{mz_mean}-{mz_width}".replace(".", "_"), base)
-        + ".feather"
-    )
-    return fn
+    Returns:
+        pd.DataFrame or None: None if the table is missing or outdated
+    """
+    if not os.path.isfile(get_workspace_db_fn(wdir)):
+        return None
+    with workspace_db(wdir) as con:
+        # Read the key and the table from the same snapshot
+        con.execute("BEGIN")
+        try:
+            source = con.execute(
+                "SELECT key, dtypes FROM _sources WHERE name = ?", (name,)
+            ).fetchone()
+            if source is None or source[0] != key:
+                return None
+            query = f"SELECT * FROM {_quote(name)}"
+            if where is not None:
+                query += f" WHERE {where}"
+            cursor = con.execute(query, tuple(params))
+            columns = [x[0] for x in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            con.execute("COMMIT")
+    df = pd.DataFrame(rows, columns=columns)
+    for col, dtype in json.loads(source[1]).items():
+        if col not in df.columns:
+            continue
+        if dtype.startswith("object"):
+            null = np.nan if dtype == "object:nan" else None
+            df[col] = df[col].astype(object).where(df[col].notna(), null)
+        elif str(df[col].dtype) != dtype:
+            try:
+                df[col] = df[col].astype(dtype)
+            except (TypeError, ValueError):
+                pass
+    return df
 
 
 def get_targets_fn(wdir):
     return os.path.join(wdir, "targets", "targets.csv")
 
 
-def get_targets(wdir):
+def get_targets(wdir, peak_labels=None):
+    """
+    Returns the targets of a workspace indexed by peak label.
+
+    Targets are served from the workspace database and only
+    parsed from the targets file when it changed. The file stays
+    authoritative, see `workspace_db()`.
+
+    Args:
+        wdir: Workspace directory
+        peak_labels: Optional list of peak labels to return
+
+    Returns:
+        pd.DataFrame
+    """
     fn = get_targets_fn(wdir)
-    if os.path.isfile(fn):
-        targets = read_targets(fn).set_index("peak_label")
-    else:
-        targets = pd.DataFrame(columns=TARGETS_COLUMNS)
-    return targets
+    if not os.path.isfile(fn):
+        return pd.DataFrame(columns=TARGETS_COLUMNS)
+    key = get_file_key(fn)
+    where, params = None, ()
+    if peak_labels is not None:
+        params = [str(x) for x in peak_labels]
+        where = f"peak_label IN ({', '.join('?' * len(params))})"
+    targets = read_workspace_table(wdir, "targets", key, where, params)
+    if targets is None:
+        targets = read_targets(fn).reset_index(drop=True)
+        write_workspace_table(wdir, "targets", targets, key, indexes=["peak_label"])
+        if peak_labels is not None:
+            targets = targets[targets.peak_label.astype(str).isin(params)]
+    return targets.set_index("peak_label")
 
 
 def update_targets(wdir, peak_label, rt_min=None, rt_max=None, rt=None):
@@ -389,21 +2267,316 @@ def update_targets(wdir, peak_label, rt_min=None, rt_max=None, rt=None):
 
 
 def get_results_fn(wdir):
+    return os.path.join(wdir, "results", "results.parquet")
+
+
+def get_results_csv_fn(wdir):
     return os.path.join(wdir, "results", "results.csv")
 
 
-def get_results(wdir):
+RESULTS_DICTIONARY_COLUMNS = [
+    "ms_file",
+    "ms_file_label",
+    "peak_label",
+    "rt_unit",
+    "target_filename",
+]
+
+
+def write_results(results, wdir, fingerprints=None):
+    """
+    Store the results of a workspace as Parquet file.
+
+    The labels of the MS files are added if missing, and
+    repetitive string columns are dictionary encoded.
+
+    Args:
+        results: Results as returned by `Mint.results`
+        wdir: Workspace directory
+        fingerprints: Optional fingerprints of the MS files and targets
+                      the results were computed from, see `run_mint`
+    """
+    results = results.reset_index(drop=True)
+    if "ms_file_label" not in results.columns:
+        labels = {fn: filename_to_label(fn) for fn in results["ms_file"].unique()}
+        results["ms_file_label"] = results["ms_file"].map(labels)
+    table = pa.Table.from_pandas(results, preserve_index=False)
+    for col in RESULTS_DICTIONARY_COLUMNS:
+        if col in table.column_names and pa.types.is_string(table.schema.field(col).type):
+            ndx = table.column_names.index(col)
+            table = table.set_column(ndx, col, table.column(col).dictionary_encode())
+    if fingerprints is not None:
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"fingerprints"] = json.dumps(fingerprints).encode()
+        table = table.replace_schema_metadata(metadata)
     fn = get_results_fn(wdir)
-    df = pd.read_csv(fn)
-    df["ms_file_label"] = [filename_to_label(fn) for fn in df["ms_file"]]
-    return df
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    fn_tmp = f"{fn}.tmp"
+    with lock(fn):
+        pq.write_table(table, fn_tmp, compression="zstd")
+        os.replace(fn_tmp, fn)
+
+
+def get_results(wdir, columns=None, peak_labels=None):
+    """
+    Returns the results of a workspace.
+
+    Results of older workspaces, stored as CSV file, are
+    converted on first access.
+
+    Args:
+        wdir: Workspace directory
+        columns: Optional list of columns to read
+        peak_labels: Optional list of peak labels to read
+
+    Returns:
+        pd.DataFrame
+    """
+    fn = get_results_fn(wdir)
+    fn_csv = get_results_csv_fn(wdir)
+    if not os.path.isfile(fn) and os.path.isfile(fn_csv):
+        write_results(pd.read_csv(fn_csv), wdir)
+    filters = None
+    if peak_labels is not None:
+        filters = [("peak_label", "in", [str(x) for x in peak_labels])]
+    table = pq.read_table(fn, columns=columns, filters=filters)
+    for ndx, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            column = table.column(ndx).cast(field.type.value_type)
+            table = table.set_column(ndx, field.name, column)
+    return table.to_pandas()
+
+
+def export_results_csv(wdir):
+    """
+    Write the results of a workspace to a CSV file.
+
+    The export is reused as long as it is newer than the results.
+
+    Returns:
+        str: Filename of the export
+    """
+    fn = get_results_fn(wdir)
+    fn_csv = get_results_csv_fn(wdir)
+    if os.path.isfile(fn_csv) and (
+        not os.path.isfile(fn) or os.path.getmtime(fn_csv) >= os.path.getmtime(fn)
+    ):
+        return fn_csv
+    results = get_results(wdir)
+    with lock(fn_csv):
+        results.to_csv(fn_csv, index=False)
+    return fn_csv
+
+
+def delete_results(wdir):
+    for fn in [get_results_fn(wdir), get_results_csv_fn(wdir)]:
+        if os.path.isfile(fn):
+            os.remove(fn)
+
+
+def read_results_fingerprints(wdir):
+    """
+    Returns the fingerprints stored with the results of a workspace.
+
+    Returns:
+        dict or None: None if the results have no fingerprints
+    """
+    fn = get_results_fn(wdir)
+    if not os.path.isfile(fn):
+        return None
+    metadata = pq.read_schema(fn).metadata or {}
+    if b"fingerprints" not in metadata:
+        return None
+    return json.loads(metadata[b"fingerprints"])
+
+
+def get_ms_file_content_hashes(wdir, ms_files) -> dict:
+    """
+    Full content hashes of MS files, see `hash_file()`.
+
+    The hash recorded in the MS file catalog is used if the file did
+    not change since it was cataloged, otherwise the file is hashed.
+
+    Returns:
+        dict: Hash by MS file
+    """
+    catalog = _read_ms_catalog(get_ms_catalog_fn(wdir), MS_CATALOG_COLUMNS)
+    hashes = {}
+    for fn in ms_files:
+        if _is_cataloged(catalog, fn):
+            hashes[fn] = catalog.content_hash[catalog.ms_file_label == filename_to_label(fn)].iloc[0]
+        else:
+            hashes[fn] = hash_file(fn)
+    return hashes
+
+
+def get_target_fingerprints(targets) -> dict:
+    """
+    Fingerprint of each target.
+
+    Args:
+        targets: Targets indexed by peak label
+
+    Returns:
+        dict: Hash of the target parameters by peak label
+    """
+    fingerprints = {}
+    for peak_label, target in targets.iterrows():
+        values = [None if pd.isna(x) else x for x in target.to_list()]
+        data = json.dumps([str(peak_label)] + values, default=_to_json)
+        fingerprints[str(peak_label)] = hashlib.blake2b(
+            data.encode(), digest_size=16
+        ).hexdigest()
+    return fingerprints
+
+
+def run_mint(wdir, targets, ms_files, nthreads=None, progress_callback=None):
+    """
+    Process MS files incrementally and store the results.
+
+    Results of MS files and targets that did not change since the
+    previous run are reused. New or changed MS files are processed
+    with all targets, and the other MS files only with new or
+    changed targets.
+
+    Args:
+        wdir: Workspace directory
+        targets: Targets indexed by peak label
+        ms_files: MS files to process
+        nthreads: Number of processes
+        progress_callback: Called with the progress in percent
+
+    Returns:
+        dict: Summary with the numbers of MS files, targets and
+              results that were 'computed' and 'reused'
+    """
+    fingerprints = {
+        "ms_mint": ms_mint.__version__,
+        "ms_files": get_ms_file_content_hashes(wdir, ms_files),
+        "targets": get_target_fingerprints(targets),
+    }
+    previous = read_results_fingerprints(wdir)
+    if previous is None or previous.get("ms_mint") != fingerprints["ms_mint"]:
+        previous = {"ms_files": {}, "targets": {}}
+
+    def unchanged(kind):
+        return [
+            key
+            for key, value in fingerprints[kind].items()
+            if previous[kind].get(key) == value
+        ]
+
+    old_files, old_targets = unchanged("ms_files"), unchanged("targets")
+    new_files = [fn for fn in ms_files if fn not in old_files]
+    new_targets = [x for x in fingerprints["targets"] if x not in old_targets]
+
+    # Pairs of new files and all targets, and of old files and new targets
+    runs = [(new_files, list(fingerprints["targets"])), (old_files, new_targets)]
+    runs = [(fns, labels) for fns, labels in runs if len(fns) > 0 and len(labels) > 0]
+    n_total = sum(len(fns) * len(labels) for fns, labels in runs)
+
+    results, n_reused = [], 0
+    if len(old_files) > 0 and len(old_targets) > 0:
+        reused = get_results(wdir)
+        reused = reused[
+            reused.ms_file.isin(old_files) & reused.peak_label.astype(str).isin(old_targets)
+        ]
+        results.append(reused)
+        n_reused = len(reused)
+
+    n_done = 0
+    for fns, labels in runs:
+        share = len(fns) * len(labels) / n_total
+
+        def set_progress(x, offset=n_done / n_total, share=share):
+            if progress_callback is not None:
+                progress_callback(100 * offset + x * share)
+
+        mint = Mint(verbose=False, progress_callback=set_progress)
+        mint.targets = targets[targets.index.astype(str).isin(labels)].reset_index()
+        mint.ms_files = fns
+        mint.run(nthreads=nthreads)
+        results.append(mint.results)
+        n_done += len(fns) * len(labels)
+
+    if len(results) > 0:
+        results = pd.concat(results, ignore_index=True)
+    else:
+        results = pd.DataFrame(columns=MINT_RESULTS_COLUMNS)
+    # Same order as a complete run
+    file_order = {fn: i for i, fn in enumerate(ms_files)}
+    target_order = {x: i for i, x in enumerate(fingerprints["targets"])}
+    order = np.lexsort(
+        (
+            results.peak_label.astype(str).map(target_order).to_numpy(),
+            results.ms_file.map(file_order).to_numpy(),
+        )
+    )
+    results = results.iloc[order].reset_index(drop=True)
+    write_results(results, wdir, fingerprints=fingerprints)
+    return {
+        "computed": {
+            "ms_files": len(new_files),
+            "targets": len(new_targets),
+            "results": len(results) - n_reused,
+        },
+        "reused": {
+            "ms_files": len(old_files),
+            "targets": len(old_targets),
+            "results": n_reused,
+        },
+    }
+
+
+_METADATA_CACHE = {}
+_METADATA_CACHE_LOCK = threading.Lock()
 
 
 def get_metadata(wdir):
+    """
+    Returns the normalized metadata of a workspace.
+
+    The result is memoized per workspace and stored in the workspace
+    database. It is reused as long as the metadata file and its change
+    log (modification time and size) and the list of MS files are
+    unchanged. Each call returns a copy, so callers can modify it.
+    """
     fn = get_metadata_fn(wdir)
+    fn_changes = get_metadata_changes_fn(wdir)
+    ms_files = tuple(get_ms_file_index(wdir).labels)
+    labels_hash = hashlib.blake2b("\n".join(ms_files).encode(), digest_size=16)
+    key = json.dumps([get_file_key(fn, fn_changes), labels_hash.hexdigest()])
+    cache_key = os.path.abspath(wdir)
+    with _METADATA_CACHE_LOCK:
+        cached = _METADATA_CACHE.get(cache_key)
+    if cached is not None and cached[0] == key:
+        return cached[1].copy()
+    # Other processes share the normalized metadata via the workspace database
+    df = read_workspace_table(wdir, "metadata", key)
+    if df is None:
+        df = _read_metadata(fn, list(ms_files), read_metadata_changes(wdir))
+        write_workspace_table(wdir, "metadata", df, key, indexes=["ms_file_label"])
+    with _METADATA_CACHE_LOCK:
+        _METADATA_CACHE[cache_key] = (key, df)
+    return df.copy()
+
+
+METADATA_COLUMNS = [
+    "color",
+    "plate_column",
+    "plate_row",
+    "plate",
+    "label",
+    "in_analysis",
+    "use_for_optimization",
+    "ms_file_label",
+    "ms_column",
+    "ionization_mode",
+]
+
+
+def _read_metadata(fn, ms_files, changes=()):
     fn_path = os.path.dirname(fn)
-    ms_files = get_ms_fns(wdir, abs_path=False)
-    ms_files = [filename_to_label(fn) for fn in ms_files]
     df = None
     if not os.path.isdir(fn_path):
         os.makedirs(fn_path)
@@ -415,18 +2588,7 @@ def get_metadata(wdir):
     if df is None or len(df) == 0:
         df = init_metadata(ms_files)
 
-    for col in [
-        "color",
-        "plate_column",
-        "plate_row",
-        "plate",
-        "label",
-        "in_analysis",
-        "use_for_optimization",
-        "ms_file_label",
-        "ms_column",
-        "ionization_mode",
-    ]:
+    for col in METADATA_COLUMNS:
         if col not in df.columns:
             df[col] = None
 
@@ -441,6 +2603,12 @@ def get_metadata(wdir):
         ndx = df[df['ms_file_label'].isin(new_files)].index
         df.loc[ndx, 'use_for_optimization'] = False
 
+    if len(changes) > 0:
+        df = apply_metadata_changes(df, changes)
+        for col in METADATA_COLUMNS:
+            if col not in df.columns:
+                df[col] = None
+
     if "use_for_optimization" not in df.columns:
         df["use_for_optimization"] = False
 
@@ -481,9 +2649,27 @@ def init_metadata(ms_files):
 
 
 def write_metadata(meta, wdir):
+    """
+    Write the complete metadata table, replacing the change log.
+
+    'metadata.csv' is written directly, the workspace database is
+    refreshed by the next `get_metadata()`.
+    """
+    with lock(get_metadata_changes_fn(wdir), timeout=60):
+        _replace_metadata(meta, wdir)
+
+
+def _replace_metadata(meta, wdir):
+    # Callers hold the lock of the change log
     fn = get_metadata_fn(wdir)
+    fn_changes = get_metadata_changes_fn(wdir)
     with lock(fn):
         meta.to_csv(fn, index=False)
+    if os.path.isfile(fn_changes):
+        os.remove(fn_changes)
+    _METADATA_CHANGE_COUNTS.pop(fn_changes, None)
+    with _METADATA_CACHE_LOCK:
+        _METADATA_CACHE.pop(os.path.abspath(wdir), None)
 
 
 def get_metadata_fn(wdir):
@@ -491,19 +2677,201 @@ def get_metadata_fn(wdir):
     return fn
 
 
+def get_metadata_changes_fn(wdir):
+    return os.path.join(wdir, "metadata", "metadata.changes.jsonl")
+
+
+METADATA_COMPACT_EVERY = 500
+
+# Number of changes by change log, with the size of the log they were counted at
+_METADATA_CHANGE_COUNTS = {}
+
+
+def update_metadata(wdir, changes):
+    """
+    Persist edits of the metadata without rewriting the table.
+
+    The changes are appended to a change log next to 'metadata.csv'
+    that is applied by `get_metadata()`. After `METADATA_COMPACT_EVERY`
+    changes the log is merged into the table.
+
+    Args:
+        wdir: Workspace directory
+        changes: List of dicts, one per change, either
+                 {"op": "set", "ms_file_label": ..., "column": ..., "value": ...},
+                 {"op": "create_column", "column": ...} or
+                 {"op": "delete_column", "column": ...}
+    """
+    fn_changes = get_metadata_changes_fn(wdir)
+    maybe_create(os.path.dirname(fn_changes))
+    with lock(fn_changes, timeout=60):
+        size = os.path.getsize(fn_changes) if os.path.isfile(fn_changes) else 0
+        counted_size, n_changes = _METADATA_CHANGE_COUNTS.get(fn_changes, (0, 0))
+        if counted_size != size:
+            # Changed by another process, or compacted
+            n_changes = _count_lines(fn_changes) if size > 0 else 0
+        with open(fn_changes, "a") as file:
+            for change in changes:
+                file.write(json.dumps(change, default=_to_json) + "\n")
+        n_changes += len(changes)
+        _METADATA_CHANGE_COUNTS[fn_changes] = (os.path.getsize(fn_changes), n_changes)
+    if n_changes >= METADATA_COMPACT_EVERY:
+        compact_metadata(wdir)
+
+
+def _count_lines(fn):
+    with open(fn, "rb") as file:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: file.read(2**20), b""))
+
+
+def _to_json(value):
+    # numpy scalars from DataFrames
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot serialize {value!r}")
+
+
+def read_metadata_changes(wdir) -> list:
+    """Returns the changes in the metadata change log of a workspace."""
+    fn_changes = get_metadata_changes_fn(wdir)
+    if not os.path.isfile(fn_changes):
+        return []
+    with open(fn_changes) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def apply_metadata_changes(df, changes):
+    """Apply changes from the metadata change log to a metadata table."""
+    df = df.set_index("ms_file_label")
+    for change in changes:
+        op, column = change.get("op", "set"), change["column"]
+        if op == "create_column":
+            if column not in df.columns:
+                df[column] = ""
+        elif op == "delete_column":
+            if column in df.columns:
+                del df[column]
+        elif column not in ("ms_file_label", "index") and change["ms_file_label"] in df.index:
+            if column not in df.columns:
+                df[column] = None
+            value = change["value"]
+            if value is not None and df[column].dtype != object and not isinstance(value, (bool, int, float)):
+                df[column] = df[column].astype(object)
+            df.loc[change["ms_file_label"], column] = value
+    return df.reset_index()
+
+
+def compact_metadata(wdir):
+    """
+    Merge the metadata change log into 'metadata.csv'.
+
+    Call this before reading 'metadata.csv' directly, e.g. with
+    `Mint.load_metadata()`.
+    """
+    fn_changes = get_metadata_changes_fn(wdir)
+    if not os.path.isfile(fn_changes):
+        return
+    with lock(fn_changes, timeout=60):
+        df = get_metadata(wdir)
+        if "index" in df.columns:
+            del df["index"]
+        _replace_metadata(df, wdir)
+
+
 def get_ms_dirname(wdir):
     return os.path.join(wdir, "ms_files")
 
 
+class MsFileIndex:
+    """
+    Index of the MS files below a directory.
+
+    The index remembers the modification times of all directories
+    it scanned and only rescans when one of them changed, so that
+    a lookup costs one `stat` per directory instead of a recursive
+    glob. Directories modified within `racy_seconds` before the scan
+    are not trusted, because changes within the timestamp resolution
+    of the file system would go unnoticed.
+    """
+
+    def __init__(self, path, racy_seconds=2):
+        self.path = path
+        self.racy_seconds = racy_seconds
+        self.fns = []
+        self.labels = {}
+        self._dir_mtimes = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Rescan the directory if it changed since the last scan."""
+        with self._lock:
+            if not self._is_current():
+                self._scan()
+        return self
+
+    def _is_current(self):
+        if self._dir_mtimes is None:
+            return False
+        for dirname, mtime_ns in self._dir_mtimes.items():
+            try:
+                if os.stat(dirname).st_mtime_ns != mtime_ns:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
+    def _scan(self):
+        fns, dir_mtimes = [], {}
+        scan_time_ns = time.time_ns()
+        racy_ns = int(self.racy_seconds * 1e9)
+        stack = [self.path]
+        while stack:
+            dirname = stack.pop()
+            try:
+                mtime_ns = os.stat(dirname).st_mtime_ns
+                entries = list(os.scandir(dirname))
+            except FileNotFoundError:
+                continue
+            # -1 forces a rescan for recently modified directories
+            dir_mtimes[dirname] = mtime_ns if scan_time_ns - mtime_ns > racy_ns else -1
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif is_ms_file(entry.name):
+                    fns.append(entry.path)
+        self.fns = sorted(fns)
+        self.labels = {filename_to_label(fn): fn for fn in self.fns}
+        self._dir_mtimes = dir_mtimes
+
+
+_MS_FILE_INDEXES = {}
+_MS_FILE_INDEXES_LOCK = threading.Lock()
+
+
+def get_ms_file_index(wdir) -> MsFileIndex:
+    """Returns the up-to-date index of the MS files of a workspace."""
+    path = os.path.abspath(get_ms_dirname(wdir))
+    with _MS_FILE_INDEXES_LOCK:
+        index = _MS_FILE_INDEXES.get(path)
+        if index is None:
+            index = _MS_FILE_INDEXES[path] = MsFileIndex(path)
+    return index.refresh()
+
+
 def get_ms_fns(wdir, abs_path=True):
-    path = get_ms_dirname(wdir)
-    fns = glob(os.path.join(path, "**", "*.*"), recursive=True)
-    fns = [fn for fn in fns if is_ms_file(fn)]
+    fns = list(get_ms_file_index(wdir).fns)
     if not abs_path:
         fns = [os.path.basename(fn) for fn in fns]
     return fns
 
 
+def get_ms_fn(wdir, ms_file_label) -> Optional[str]:
+    """Returns the path of the MS file with a given label, None if there is none."""
+    return get_ms_file_index(wdir).labels.get(ms_file_label)
+
+
 def is_ms_file(fn: str):
     if (
         fn.lower().endswith(".mzxml")
@@ -542,9 +2910,12 @@ def get_complete_results(
     exclude_labels=None,
     file_types=None,
     include_excluded=False,
+    columns=None,
 ):
     meta = get_metadata(wdir)
-    resu = get_results(wdir)
+    if columns is not None:
+        columns = list(dict.fromkeys(["ms_file_label", "peak_label", "peak_max"] + columns))
+    resu = get_results(wdir, columns=columns, peak_labels=include_labels or None)
 
     if not include_excluded:
         meta = meta[meta["in_analysis"]]
@@ -711,12 +3082,12 @@ def merge_metadata(old: pd.DataFrame, new: pd.DataFrame, index_col='ms_file_labe
             continue
         if not col in old.columns:
             old[col] = None
-        for ndx in new.index:
-            value = new.loc[ndx, col]
-            if value is None:
-                continue
-            if ndx in old.index:
-                old.loc[ndx, col] = value
+        values = new[col]
+        # None means keep the old value, NaN overwrites it
+        values = values[[value is not None for value in values.values]]
+        update = old.index.isin(values.index)
+        if update.any():
+            old.loc[update, col] = values.reindex(old.index[update]).values
 
     return old.reset_index()
 
@@ -771,9 +3142,8 @@ def get_ms_fns_for_peakopt(wdir):
     the metadata table and recreate the complete filename."""
     df = get_metadata(wdir)
     fns = df[df.use_for_optimization.astype(bool) == True]["ms_file_label"]
-    ms_files = get_ms_fns(wdir)
-    mapping = {filename_to_label(fn): fn for fn in ms_files}
-    fns = [mapping[fn] for fn in fns]
+    index = get_ms_file_index(wdir)
+    fns = [index.labels[fn] for fn in fns]
     return fns
 
 
@@ -784,6 +3154,12 @@ def float_to_color(x, vmin=0, vmax=2, cmap=None):
 
 
 def write_targets(targets, wdir):
+    """
+    Write the targets file of a workspace.
+
+    The copy in the workspace database is replaced by the next
+    `get_targets()`.
+    """
     fn = get_targets_fn(wdir)
     if "peak_label" in targets.columns:
         targets = targets.set_index("peak_label")
@@ -797,47 +3173,284 @@ def filename_to_label(fn: str):
     return os.path.basename(fn)
 
 
+class _LinkParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+
+
 def get_filenames_from_url(url):
     if url.startswith("ftp"):
         return get_filenames_from_ftp_directory(url)
-    if "://" in url:
-        url = url.split("://")[1]
+    return _get_links_from_url(url)[1]
+
+
+def get_file_urls_from_url(url):
+    """
+    Absolute URLs of the files of a HTTP or FTP directory listing.
+
+    Links are resolved against the URL the listing was served from,
+    after redirects.
+    """
+    if url.startswith("ftp"):
+        url = url if url.endswith("/") else url + "/"
+        return [urljoin(url, quote(x)) for x in get_filenames_from_ftp_directory(url)]
+    base_url, links = _get_links_from_url(url)
+    return [urljoin(base_url, x) for x in links]
+
+
+def _get_links_from_url(url):
     with urllib3.PoolManager() as http:
         r = http.request("GET", url)
-    soup = BeautifulSoup(r.data, "html")
-    files = [A["href"] for A in soup.find_all("a", href=True)]
-    return files
+    if not 200 <= r.status < 300:
+        raise IOError(f"Could not read {url}: HTTP {r.status}")
+    parser = _LinkParser()
+    parser.feed(r.data.decode("utf-8", errors="replace"))
+    return urljoin(url, r.url or ""), parser.links
 
 
 def get_filenames_from_ftp_directory(url):
     url_parts = urlparse(url)
-    domain = url_parts.netloc
-    path = url_parts.path
-    ftp = ftplib.FTP(domain)
-    ftp.login()
-    ftp.cwd(path)
+    ftp = _ftp_connect(url_parts)
+    ftp.cwd(url_parts.path or "/")
     filenames = ftp.nlst()
     ftp.quit()
     return filenames
 
 
-def import_from_local_path(path, target_dir, fsc=None):
+def _ftp_connect(url_parts):
+    ftp = ftplib.FTP()
+    ftp.connect(url_parts.hostname, url_parts.port or 21)
+    ftp.login(url_parts.username or "anonymous", url_parts.password or "")
+    return ftp
+
+
+def download_file(url, fn_out, expected_size=None, expected_hash=None, http=None, chunk_size=2**20):
+    """
+    Download a file via HTTP(S) or FTP, resuming a partial download.
+
+    The data is written to '<fn_out>.part', which is continued by
+    the next call if the download is interrupted, and renamed to
+    `fn_out` after the size (and hash) are verified.
+
+    Args:
+        url: URL of the file
+        fn_out: Output filename
+        expected_size: Size in bytes, defaults to the size reported
+                       by the server
+        expected_hash: Expected hash as '<algorithm>:<hex digest>',
+                       e.g. 'sha256:...', optional
+        http: urllib3.PoolManager to share connections between downloads
+        chunk_size: Size of the chunks written to disk
+
+    Returns:
+        str: Filename of the downloaded file
+    """
+    fn_part = f"{fn_out}.part"
+    if url.startswith("ftp"):
+        size = _download_ftp(url, fn_part, chunk_size)
+    else:
+        size = _download_http(url, fn_part, http or urllib3.PoolManager(), chunk_size)
+    expected_size = expected_size if expected_size is not None else size
+    actual_size = os.path.getsize(fn_part)
+    if expected_size is not None and actual_size != expected_size:
+        raise IOError(f"Incomplete download of {url}: {actual_size} of {expected_size} bytes.")
+    if expected_hash is not None:
+        algorithm, expected = expected_hash.split(":", 1)
+        digest = hashlib.new(algorithm)
+        with open(fn_part, "rb") as file:
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != expected.lower():
+            os.remove(fn_part)
+            raise IOError(f"Hash mismatch for {url}.")
+    os.replace(fn_part, fn_out)
+    return str(fn_out)
+
+
+def _download_http(url, fn_part, http, chunk_size):
+    # Returns the total size reported by the server, None if unknown
+    offset = os.path.getsize(fn_part) if os.path.isfile(fn_part) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+    r = http.request("GET", url, headers=headers, preload_content=False)
+    try:
+        if r.status == 416:
+            # The partial file is already complete
+            return offset
+        if r.status not in (200, 206):
+            raise IOError(f"Could not download {url}: HTTP {r.status}")
+        if r.status == 200:
+            # Server ignored the range request, start over
+            offset = 0
+        with open(fn_part, "ab" if offset > 0 else "wb") as file:
+            for chunk in r.stream(chunk_size):
+                file.write(chunk)
+        length = r.headers.get("Content-Length")
+        return offset + int(length) if length is not None else None
+    finally:
+        r.release_conn()
+
+
+def _download_ftp(url, fn_part, chunk_size):
+    url_parts = urlparse(url)
+    path = unquote(url_parts.path)
+    offset = os.path.getsize(fn_part) if os.path.isfile(fn_part) else 0
+    ftp = _ftp_connect(url_parts)
+    try:
+        ftp.voidcmd("TYPE I")
+        size = ftp.size(path)
+        if size is not None and offset >= size:
+            return size
+        with open(fn_part, "ab" if offset > 0 else "wb") as file:
+            ftp.retrbinary(f"RETR {path}", file.write, blocksize=chunk_size, rest=offset or None)
+        return size
+    finally:
+        ftp.quit()
+
+
+def import_from_url(
+    url, wdir, max_connections=4, ncpu=None, hashes=None, progress_callback=None
+):
+    """
+    Download all MS files of a HTTP or FTP directory listing into
+    a workspace.
+
+    Files are downloaded concurrently over a bounded connection pool.
+    Each finished download is handed to a worker process that
+    converts it and adds it to the catalog (see `prepare_ms_file()`)
+    while the other downloads continue. Interrupted downloads are
+    resumed by the next import, files that were imported before
+    are skipped.
+
+    Args:
+        url: URL of the directory listing, files can be linked from
+             other directories and are saved under their name
+        wdir: Workspace directory
+        max_connections: Maximum number of concurrent downloads
+        ncpu: Number of conversion processes, defaults to `--ncpu`
+        hashes: Mapping of filenames to expected hashes, see `download_file()`
+        progress_callback: Called with the progress in percent
+
+    Returns:
+        tuple: (imported, errors) mapping the URLs of the files to the
+               feather filenames and to the error messages, respectively
+    """
+    ms_dir = get_ms_dirname(wdir)
+    maybe_create(ms_dir)
+    hashes = hashes or {}
+    # Files are saved under the last part of their URL
+    urls = {}
+    for file_url in get_file_urls_from_url(url):
+        name = unquote(P(urlparse(file_url).path).name)
+        if not is_ms_file(name):
+            continue
+        if urls.setdefault(name, file_url) != file_url:
+            logging.warning(f"Skipping {file_url}, {name} is imported from {urls[name]}.")
+    names = [
+        name for name in sorted(urls)
+        if not os.path.isfile(os.path.join(ms_dir, P(name).with_suffix(".feather").name))
+    ]
+    n_files = len(names)
+    imported, errors = {}, {}
+    if n_files == 0:
+        return imported, errors
+    conversion_futures = set()
+
+    ncpu = min(ncpu or get_ncpu() or multiprocessing.cpu_count(), n_files)
+    http = urllib3.PoolManager(maxsize=max_connections)
+    with ThreadPoolExecutor(max_workers=max_connections) as downloads, \
+            ProcessPoolExecutor(max_workers=ncpu, initializer=_disable_ms_file_cache) as conversions:
+        pending = {}
+        for name in names:
+            file_url = urls[name]
+            future = downloads.submit(
+                download_file,
+                file_url,
+                os.path.join(ms_dir, name),
+                expected_hash=hashes.get(name),
+                http=http,
+            )
+            pending[future] = file_url
+        n_done = 0
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_url = pending.pop(future)
+                if future.exception() is not None:
+                    logging.warning(f"Could not import {file_url}: {future.exception()}")
+                    errors[file_url] = str(future.exception())
+                elif future in conversion_futures:
+                    imported[file_url] = future.result()
+                else:
+                    # Download finished, convert while the others continue
+                    conversion = conversions.submit(prepare_ms_file, future.result(), wdir)
+                    conversion_futures.add(conversion)
+                    pending[conversion] = file_url
+                    continue
+                n_done += 1
+                if progress_callback is not None:
+                    progress_callback(int(100 * n_done / n_files))
+    http.clear()
+    return imported, errors
+
+
+def import_from_local_path(path, target_dir, fsc=None, wdir=None):
+    """
+    Import all MS files below a directory into a workspace.
+
+    Files are identified by the hash of their content. Files that
+    are identical to a file in the workspace, or to another file of
+    the import, are linked instead of converted.
+
+    Args:
+        path: Directory to import from
+        target_dir: MS file directory of the workspace
+        fsc: Cache for the progress of the import
+        wdir: Workspace directory, defaults to the parent of `target_dir`
+
+    Returns:
+        tuple: (list of the imported feather files, dict of error
+               messages by source file of the files that failed)
+    """
+    if wdir is None:
+        wdir = str(P(target_dir).parent)
     fns = glob(os.path.join(path, "**", "*.*"), recursive=True)
     fns = [fn for fn in fns if is_ms_file(fn)]
-    fns_out = []
-    n_files = len(fns)
-    for i, fn in enumerate(tqdm(fns)):
-        if fsc is not None:
-            fsc.set("progress", int(100 * (1 + i) / n_files))
-        fn_out = P(target_dir) / P(fn).with_suffix(".feather").name
+    fns_in, fns_out, source_hashes, duplicates = [], [], {}, []
+    first_by_hash = {}
+    for fn in fns:
+        fn_out = str(P(target_dir) / P(fn).with_suffix(".feather").name)
         if P(fn_out).is_file():
             continue
+        source_hash = hash_file(fn)
+        duplicate = first_by_hash.get(source_hash) or find_duplicate_ms_file(source_hash, wdir)
+        if duplicate is not None:
+            duplicates.append((duplicate, fn_out))
+            continue
+        first_by_hash[source_hash] = fn_out
+        fns_in.append(fn)
         fns_out.append(fn_out)
-        try:
-            convert_ms_file_to_feather(fn, fn_out)
-        except:
-            logging.warning(f"Could not convert {fn}")
-    return fns_out
+        source_hashes[fn_out] = source_hash
+    progress_callback = None
+    if fsc is not None:
+        progress_callback = lambda progress: fsc.set("progress", progress)
+    converted, errors = convert_ms_files(fns_in, fns_out, progress_callback=progress_callback)
+    for fn, error in errors.items():
+        logging.warning(f"Could not import {fn}: {error}")
+    imported = list(converted.values())
+    update_ms_catalog(wdir, imported, source_hashes=source_hashes)
+    for fn_src, fn_dst in duplicates:
+        if os.path.isfile(fn_src):
+            logging.info(f"{fn_dst} is identical to {fn_src}, linking it.")
+            link_ms_file(fn_src, fn_dst, wdir)
+            imported.append(fn_dst)
+    return imported, errors
 
 
 def df_to_in_memory_csv_file(df):
@@ -860,22 +3473,25 @@ def has_na(df):
     return df.isna().sum().sum() > 0
 
 
-def fix_first_emtpy_line_after_upload_workaround(file_path):
+def fix_first_emtpy_line_after_upload_workaround(file_path, chunk_size=2**20):
     logging.warning(f'Check if first line is empty in {file_path}.')
 
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    if not lines:
-        return
+    with open(file_path, 'rb') as file:
+        head = file.read(2)
+        if head[:1] == b"\n":
+            offset = 1
+        elif head == b"\r\n":
+            offset = 2
+        else:
+            return
 
-    # Check if the first line is an empty line (contains only newline character)
-    if lines[0] == "\n":
+        # Copy the rest of the file in chunks instead of reading all lines
         logging.warning(f'Empty first line detected in {file_path}. Removing it.')
-        lines.pop(0)
-        
-        with open(file_path, 'w') as file:
-            file.writelines(lines)
+        file.seek(offset)
+        fn_tmp = f"{file_path}.tmp"
+        with open(fn_tmp, 'wb') as out:
+            shutil.copyfileobj(file, out, chunk_size)
+    os.replace(fn_tmp, file_path)
 
 
 def describe_transformation(var_name, apply, groupby, scaler):
@@ -0,0 +1,50 @@
+"""
+Benchmarks of vectorized tools against the implementations they replace.
+
+Run with `python tests/benchmark.py`. The results are compared for
+equality in the test suite, this script only reports the runtimes.
+"""
+
+import time
+
+from ms_mint_app import tools as T
+
+from test__tools import (
+    _max_intensity_inputs,
+    _max_intensity_per_scan_time_groupby,
+    _merge_metadata_inputs,
+    _merge_metadata_loop,
+)
+
+
+def benchmark(name, reference, candidate):
+    start = time.perf_counter()
+    reference()
+    t_reference = time.perf_counter() - start
+    start = time.perf_counter()
+    candidate()
+    t_candidate = time.perf_counter() - start
+    print(f"{name}: {t_reference:.3f}s -> {t_candidate:.4f}s ({t_reference / t_candidate:.1f}x)")
+
+
+def benchmark_merge_metadata():
+    old, new = _merge_metadata_inputs()
+    benchmark(
+        "merge_metadata",
+        lambda: _merge_metadata_loop(old, new),
+        lambda: T.merge_metadata(old, new),
+    )
+
+
+def benchmark_max_intensity_per_scan_time():
+    args = _max_intensity_inputs()
+    benchmark(
+        "max_intensity_per_scan_time",
+        lambda: _max_intensity_per_scan_time_groupby(*args),
+        lambda: T.max_intensity_per_scan_time(*args),
+    )
+
+
+if __name__ == "__main__":
+    benchmark_merge_metadata()
+    benchmark_max_intensity_per_scan_time()
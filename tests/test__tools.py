@@ -1,6 +1,20 @@
+import io
+import os
+import json
+import base64
+import hashlib
+import functools
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
 import pandas as pd
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path as P
 
+from ms_mint.io import ms_file_to_df
 from ms_mint_app import tools as T
 
 def test__merge_metadata():
@@ -47,6 +61,46 @@ def test__merge_metadata():
     
     
 
+def _merge_metadata_loop(old, new, index_col="ms_file_label"):
+    # Cell by cell reference implementation of T.merge_metadata()
+    old = old.set_index(index_col)
+    new = new.groupby(index_col).first().replace("null", None)
+    for col in new.columns:
+        if col == "" or col.startswith("Unnamed"):
+            continue
+        if not col in old.columns:
+            old[col] = None
+        for ndx in new.index:
+            value = new.loc[ndx, col]
+            if value is None:
+                continue
+            if ndx in old.index:
+                old.loc[ndx, col] = value
+    return old.reset_index()
+
+
+def _merge_metadata_inputs(n_rows=1000, n_cols=10):
+    rng = np.random.default_rng(1)
+    labels = [f"file{i}" for i in range(n_rows)]
+    old = pd.DataFrame({"ms_file_label": labels})
+    for i in range(n_cols):
+        old[f"col{i}"] = rng.choice(["a", "b", "c"], n_rows)
+    old["n"] = np.arange(n_rows)
+    new = pd.DataFrame({"ms_file_label": rng.choice(labels + ["not-in-old"], n_rows)})
+    for i in range(0, n_cols + 5, 2):
+        new[f"col{i}"] = rng.choice(["x", "null", None, np.nan], n_rows)
+    new["n"] = rng.integers(0, 10, n_rows)
+    new["Unnamed: 0"] = 1
+    return old, new
+
+
+def test__merge_metadata_matches_loop():
+    old, new = _merge_metadata_inputs()
+    expected = _merge_metadata_loop(old, new)
+    actual = T.merge_metadata(old, new)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
 def test__get_metadata(tmp_path):
     
     T.create_workspace(tmp_path, 'test')
@@ -112,4 +166,866 @@ def test__get_metadata_after_more_files_added(tmp_path):
 
     assert all(metadata.use_for_optimization == [True, False, False, False])
     
-    
\ No newline at end of file
+    
+
+def _write_test_ms_file(fn, n_scans=200, n_peaks=50, seed=1):
+    rng = np.random.default_rng(seed)
+    scan_time = np.repeat(np.arange(n_scans, dtype=np.float32) * 0.5, n_peaks)
+    mz = rng.uniform(100, 500, n_scans * n_peaks).astype(np.float32)
+    intensity = rng.integers(1, 10000, n_scans * n_peaks)
+    df = pd.DataFrame(
+        {
+            "scan_id": np.repeat(np.arange(n_scans), n_peaks),
+            "ms_level": 1,
+            "polarity": "+",
+            "scan_time": scan_time,
+            "mz": mz,
+            "intensity": intensity,
+        }
+    )
+    df.to_feather(fn)
+    return df
+
+
+def test__extract_chromatograms_matches_masking():
+    df = _write_test_ms_file(io.BytesIO())
+    targets = [(150.0, 10000), (300.0, 5000), (450.0, 20000), (999.0, 10)]
+    mz_means, mz_widths = np.array(targets).T
+
+    chroms = T.extract_chromatograms(df, mz_means, mz_widths)
+
+    assert len(chroms) == len(targets)
+    for (mz_mean, mz_width), chrom in zip(targets, chroms):
+        dmz = mz_mean * 1e-6 * mz_width
+        expected = df[(df["mz"] - mz_mean).abs() <= dmz]
+        expected = expected.groupby("scan_time").max().reset_index()
+        assert np.array_equal(chrom["scan_time"], expected["scan_time"])
+        assert np.array_equal(chrom["intensity"], expected["intensity"])
+
+
+def test__chromatograms_create_all(tmp_path):
+    T.create_workspace(tmp_path, "test")
+    wdir = P(tmp_path / "workspaces", "test")
+    fn = str(wdir / "ms_files" / "F1.feather")
+    _write_test_ms_file(fn)
+    targets = pd.DataFrame(
+        {"peak_label": ["A", "B"], "mz_mean": [150.0, 300.0], "mz_width": [10000, 5000]}
+    ).set_index("peak_label")
+
+    T.Chromatograms(wdir, targets, [fn]).create_all()
+
+    fn_store = T.get_chromatogram_store_fn(fn, wdir)
+    assert sorted(os.listdir(wdir / "chromato")) == ["F1.arrow", "F1.arrow.lock"]
+    for mz_mean, mz_width in targets.itertuples(index=False):
+        key = T.get_chromatogram_key(mz_mean, mz_width)
+        actual = T.read_chromatogram(fn_store, key)
+        expected = T.create_chromatogram(fn, mz_mean, mz_width, str(tmp_path / "x.arrow"))
+        pd.testing.assert_frame_equal(actual, expected)
+
+
+def test__chromatogram_store_roundtrip(tmp_path):
+    fn = tmp_path / "chromato" / "F1.arrow"
+    a = pd.DataFrame({"scan_time": [1.0, 2.0], "intensity": [10.0, 20.0]})
+    b = pd.DataFrame({"scan_time": [], "intensity": []})
+    c = pd.DataFrame({"scan_time": [3.0], "intensity": [5.0]})
+
+    T.write_chromatograms(fn, {"a": a, "b": b})
+    T.write_chromatograms(fn, {"c": c, "a": c})
+
+    assert T.read_chromatogram_index(fn) == {"a": 0, "b": 1, "c": 2}
+    pd.testing.assert_frame_equal(T.read_chromatogram(fn, "a"), c)
+    assert len(T.read_chromatogram(fn, "b")) == 0
+    assert T.read_chromatogram(fn, "missing") is None
+
+
+def test__chromatograms_create_all_parallel(tmp_path):
+    T.create_workspace(tmp_path, "test")
+    wdir = P(tmp_path / "workspaces", "test")
+    fns = []
+    for i in range(3):
+        fn = str(wdir / "ms_files" / f"F{i}.feather")
+        _write_test_ms_file(fn, seed=i)
+        fns.append(fn)
+    targets = pd.DataFrame(
+        {"peak_label": ["A", "B"], "mz_mean": [150.0, 300.0], "mz_width": [10000, 5000]}
+    ).set_index("peak_label")
+    progress = []
+
+    T.Chromatograms(wdir, targets, fns, progress_callback=progress.append).create_all(ncpu=2)
+
+    assert progress == [33, 66, 100]
+    for fn in fns:
+        index = T.read_chromatogram_index(T.get_chromatogram_store_fn(fn, wdir))
+        assert sorted(index) == ["150.0000-10000.0", "300.0000-5000.0"]
+
+
+def test__ms_file_cache(tmp_path):
+    fns = [str(tmp_path / f"F{i}.feather") for i in range(3)]
+    for i, fn in enumerate(fns):
+        _write_test_ms_file(fn, seed=i)
+    n_bytes = T.read_ms_file(fns[0]).memory_usage(index=True, deep=True).sum()
+    cache = T.MsFileCache(max_bytes=2 * n_bytes)
+
+    df = cache.get(fns[0])
+    assert cache.get(fns[0]) is df
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.get(fns[1])
+    cache.get(fns[0])
+    cache.get(fns[2])  # evicts the least recently used file (F1)
+    assert cache.info()["n_files"] == 2
+    assert cache.n_bytes <= cache.max_bytes
+    cache.get(fns[0])
+    assert (cache.hits, cache.misses) == (3, 3)
+
+    # Replaced files are parsed again
+    _write_test_ms_file(fns[0], n_scans=10, seed=5)
+    assert len(cache.get(fns[0])) == 10 * 50
+    assert cache.misses == 4
+
+    # The polarity strings are counted
+    assert cache.n_bytes == sum(df.memory_usage(index=True, deep=True).sum() for df, _ in cache._entries.values())
+    assert cache.n_bytes > sum(df.memory_usage(index=True).sum() for df, _ in cache._entries.values())
+
+
+def test__mz_sorted_ms_file(tmp_path):
+    fn = str(tmp_path / "F1.feather")
+    df = _write_test_ms_file(fn)
+    mz_means = np.array([100.5, 150.0, 300.0, 499.9, 999.0])
+    mz_widths = np.array([5000, 10000, 5000, 1000, 10])
+    expected = T.extract_chromatograms(df, mz_means, mz_widths)
+
+    fn_sorted = T.write_mz_sorted_ms_file(fn, block_size=100)
+    assert fn_sorted == str(tmp_path / "F1.mzsorted.arrow")
+    assert T.has_valid_mz_sorted_copy(fn)
+
+    actual = T.extract_chromatograms_from_ms_file(fn, mz_means, mz_widths)
+    for a, e in zip(actual, expected):
+        pd.testing.assert_frame_equal(a, e)
+
+    # The copy is ignored once the MS file is replaced
+    _write_test_ms_file(fn, n_scans=10)
+    assert not T.has_valid_mz_sorted_copy(fn)
+
+
+def _max_intensity_inputs(n_chroms=2000, n_points=200):
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(0, 2 * n_points, n_chroms)
+    scan_time = rng.integers(0, n_points, lengths.sum()).astype(np.float32) * 0.5
+    intensity = rng.integers(0, 10000, lengths.sum())
+    return scan_time, intensity, lengths
+
+
+def _max_intensity_per_scan_time_groupby(scan_time, intensity, lengths):
+    # Per target pandas groupby replaced by T.max_intensity_per_scan_time
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return [
+        pd.DataFrame({"scan_time": scan_time[a:b], "intensity": intensity[a:b]})
+        .groupby("scan_time")
+        .max()
+        .reset_index()
+        for a, b in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def test__max_intensity_per_scan_time_matches_groupby():
+    scan_time, intensity, lengths = _max_intensity_inputs()
+    expected = _max_intensity_per_scan_time_groupby(scan_time, intensity, lengths)
+    actual = T.max_intensity_per_scan_time(scan_time, intensity, lengths)
+    assert len(actual) == len(lengths)
+    for a, e in zip(actual, expected):
+        pd.testing.assert_frame_equal(a, e)
+
+
+def test__get_chromatogram_matrix(tmp_path):
+    T.create_workspace(tmp_path, "test")
+    wdir = P(tmp_path / "workspaces", "test")
+    fns = []
+    for i in range(3):
+        fn = str(wdir / "ms_files" / f"F{i}.feather")
+        _write_test_ms_file(fn, n_scans=100 + 20 * i, seed=i)
+        fns.append(fn)
+
+    time_points, intensities = T.get_chromatogram_matrix(fns, 150.0, 10000, wdir)
+
+    assert intensities.dtype == np.float32
+    assert intensities.shape == (3, len(time_points))
+    assert np.allclose(np.diff(time_points), 0.25)
+    for fn, row in zip(fns, intensities):
+        chrom = T.get_chromatogram(fn, 150.0, 10000, wdir)
+        in_chrom = np.isin(time_points, chrom["scan_time"])
+        assert np.allclose(row[in_chrom], chrom.set_index("scan_time").loc[time_points[in_chrom], "intensity"])
+
+    # Served from the cache until the selection of files changes
+    fn_matrix = T.get_chromatogram_matrix_fn(150.0, 10000, wdir)
+    mtime = os.path.getmtime(fn_matrix)
+    T.get_chromatogram_matrix(fns, 150.0, 10000, wdir)
+    assert os.path.getmtime(fn_matrix) == mtime
+    _, intensities = T.get_chromatogram_matrix(fns[:2], 150.0, 10000, wdir)
+    assert intensities.shape[0] == 2
+
+
+def test__shared_windows_are_extracted_once(tmp_path):
+    T.create_workspace(tmp_path, "test")
+    wdir = P(tmp_path / "workspaces", "test")
+    fn = str(wdir / "ms_files" / "F1.feather")
+    _write_test_ms_file(fn)
+    targets = pd.DataFrame(
+        {
+            "peak_label": ["glucose", "fructose", "other"],
+            "mz_mean": [180.06339999, 180.0634, 300.0],
+            "mz_width": [10, 10.0, 5],
+        }
+    ).set_index("peak_label")
+
+    windows = T.get_target_windows(targets)
+    assert windows.loc["glucose", "key"] == windows.loc["fructose", "key"]
+
+    T.Chromatograms(wdir, targets, [fn]).create_all()
+
+    index = T.read_chromatogram_index(T.get_chromatogram_store_fn(fn, wdir))
+    assert sorted(index) == ["180.0634-10.0", "300.0000-5.0"]
+
+
+def test__chromatogram_store_is_invalidated_and_built_incrementally(tmp_path):
+    T.create_workspace(tmp_path, "test")
+    wdir = P(tmp_path / "workspaces", "test")
+    fn = str(wdir / "ms_files" / "F1.feather")
+    _write_test_ms_file(fn, seed=1)
+    targets = pd.DataFrame(
+        {"peak_label": ["A"], "mz_mean": [150.0], "mz_width": [10000]}
+    ).set_index("peak_label")
+    T.Chromatograms(wdir, targets, [fn]).create_all(ncpu=1)
+
+    fn_store = T.get_chromatogram_store_fn(fn, wdir)
+    manifest = T.read_chromatogram_manifest(fn_store)
+    assert manifest["source"] == T.get_ms_file_fingerprint(fn)
+    assert manifest["params"] == {"150.0000-10000.0": {"time_step": 0.25}}
+
+    # Adding a target only builds the missing window
+    targets.loc["B"] = [300.0, 5000]
+    chroms = T.Chromatograms(wdir, targets, [fn])
+    assert chroms.get_incomplete_ms_files() == [fn]
+    chroms.create_all(ncpu=1)
+    assert chroms.get_incomplete_ms_files() == []
+
+    # Replacing the MS file invalidates its chromatograms
+    _write_test_ms_file(fn, seed=2)
+    assert chroms.get_incomplete_ms_files() == [fn]
+    assert not os.path.isfile(fn_store)
+    actual = T.get_chromatogram(fn, 150.0, 10000, wdir)
+    expected = T.create_chromatogram(fn, 150.0, 10000, str(tmp_path / "x.arrow"))
+    pd.testing.assert_frame_equal(actual, expected)
+
+    # Stores written without source get one on the next write
+    fn_other = str(tmp_path / "y.arrow")
+    T.write_chromatograms(fn_other, {"a": expected})
+    T.write_chromatograms(fn_other, {"b": expected}, source=T.get_ms_file_fingerprint(fn))
+    assert list(T.read_chromatogram_index(fn_other)) == ["b"]
+
+    # Corrupt stores are rebuilt
+    with open(fn_store, "wb") as file:
+        file.write(b"corrupt")
+    T._VALID_CHROMATOGRAM_STORES.clear()
+    pd.testing.assert_frame_equal(T.get_chromatogram(fn, 150.0, 10000, wdir), expected)
+
+
+def test__get_chromatogram_rt_window(tmp_path):
+    T.create_workspace(tmp_path, "test")
+    wdir = P(tmp_path / "workspaces", "test")
+    fn = str(wdir / "ms_files" / "F1.feather")
+    _write_test_ms_file(fn)
+
+    full = T.get_chromatogram(fn, 150.0, 10000, wdir)
+    actual = T.get_chromatogram(fn, 150.0, 10000, wdir, rt_min=10, rt_max=20)
+    expected = full[full.scan_time.between(10, 20)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual, expected)
+
+    fn_store = T.get_chromatogram_store_fn(fn, wdir)
+    key = T.get_chromatogram_key(150.0, 10000)
+    actual = T.read_chromatogram(fn_store, key, rt_min=np.nan, rt_max=20)
+    pd.testing.assert_frame_equal(actual, full[full.scan_time <= 20])
+    assert len(T.read_chromatogram(fn_store, key, rt_min=1e6)) == 0
+
+
+def test__chromatogram_storage_options(tmp_path, monkeypatch):
+    chrom = pd.DataFrame(
+        {
+            "scan_time": np.arange(0, 600, 0.25).round(3),
+            "intensity": np.random.default_rng(1).lognormal(8, 2, 2400),
+        }
+    )
+    sizes = {}
+    for dtype, compression in [("float64", "none"), ("float32", "zstd"), ("float32", "lz4")]:
+        monkeypatch.setenv("MINT_CHROMATOGRAM_DTYPE", dtype)
+        monkeypatch.setenv("MINT_CHROMATOGRAM_COMPRESSION", compression)
+        fn = tmp_path / f"{dtype}-{compression}.arrow"
+        T.write_chromatograms(fn, {"a": chrom})
+        sizes[(dtype, compression)] = os.path.getsize(fn)
+        actual = T.read_chromatogram(fn, "a")
+        assert actual.dtypes.to_list() == [np.float64, np.float64]
+        np.testing.assert_array_equal(actual.scan_time, chrom.scan_time)
+        np.testing.assert_allclose(actual.intensity, chrom.intensity, rtol=1e-6)
+        if dtype == "float64":
+            pd.testing.assert_frame_equal(actual, chrom)
+
+    assert sizes[("float32", "zstd")] < sizes[("float64", "none")] / 2
+    assert sizes[("float32", "lz4")] < sizes[("float64", "none")]
+
+
+def test__convert_ms_files_reports_errors(tmp_path):
+    fns = [str(tmp_path / f"F{i}.feather") for i in range(3)]
+    for fn in fns:
+        _write_test_ms_file(fn)
+    fn_broken = str(tmp_path / "broken.mzML")
+    with open(fn_broken, "w") as file:
+        file.write("not an mzML file")
+    progress = []
+
+    converted, errors = T.convert_ms_files(
+        fns + [fn_broken], mz_sorted=True, ncpu=2, progress_callback=progress.append
+    )
+
+    assert converted == {fn: fn for fn in fns}
+    assert list(errors) == [fn_broken]
+    assert all(T.has_valid_mz_sorted_copy(fn) for fn in fns)
+    assert progress == [25, 50, 75, 100]
+
+
+def _write_test_mzml_file(fn, n_scans=20):
+    def encode(values, dtype):
+        return base64.b64encode(np.asarray(values, dtype=dtype).tobytes()).decode()
+
+    def cv_param(accession, name, value="", unit=""):
+        return f'<cvParam cvRef="MS" accession="{accession}" name="{name}" value="{value}"{unit}/>'
+
+    def binary_data_array(values, dtype, precision, array):
+        return (
+            '<binaryDataArray encodedLength="0">'
+            + cv_param(*precision)
+            + cv_param("MS:1000576", "no compression")
+            + cv_param(*array)
+            + f"<binary>{encode(values, dtype)}</binary></binaryDataArray>"
+        )
+
+    minute = ' unitCvRef="UO" unitAccession="UO:0000031" unitName="minute"'
+    spectra = []
+    for i in range(n_scans):
+        mz = np.linspace(100, 500, 5 + i % 3)
+        intensity = np.arange(len(mz)) * 10.5 + i
+        spectra.append(
+            f"""<spectrum index="{i}" id="scan={i + 1}" defaultArrayLength="{len(mz)}">
+{cv_param("MS:1000511", "ms level", 1)}
+{cv_param("MS:1000130", "positive scan")}
+<scanList count="1"><scan>{cv_param("MS:1000016", "scan start time", 0.1 * i, minute)}</scan></scanList>
+<binaryDataArrayList count="2">
+{binary_data_array(mz, "<f8", ("MS:1000523", "64-bit float"), ("MS:1000514", "m/z array"))}
+{binary_data_array(intensity, "<f4", ("MS:1000521", "32-bit float"), ("MS:1000515", "intensity array"))}
+</binaryDataArrayList></spectrum>"""
+        )
+    with open(fn, "w") as file:
+        file.write(
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0">\n'
+            f'<run id="run"><spectrumList count="{n_scans}">\n'
+            + "\n".join(spectra)
+            + "\n</spectrumList></run></mzML>\n"
+        )
+
+
+def test__stream_ms_file_to_feather(tmp_path):
+    fn = str(tmp_path / "F1.mzML")
+    _write_test_mzml_file(fn)
+
+    fn_out = T.stream_ms_file_to_feather(fn, batch_size=16)
+
+    assert fn_out == str(tmp_path / "F1.feather")
+    expected = ms_file_to_df(fn)
+    pd.testing.assert_frame_equal(pd.read_feather(fn_out), expected)
+    with pa.memory_map(fn_out, "r") as source:
+        assert pa.ipc.open_file(source).num_record_batches > 1
+
+
+def test__parse_ms_files_decodes_in_chunks(tmp_path):
+    data = os.urandom(10_000)
+    contents = "data:application/octet-stream;base64," + base64.b64encode(data).decode()
+
+    T.write_data_url_to_file(contents, tmp_path / "F1.bin", chunk_size=1001)
+    T.parse_ms_files(contents, "F2.feather", None, str(tmp_path))
+
+    assert (tmp_path / "F1.bin").read_bytes() == data
+    assert (tmp_path / "F2.feather").read_bytes() == data
+
+
+def test__ms_file_queue_prepares_uploaded_files(tmp_path):
+    T.create_workspace(tmp_path, "test")
+    wdir = str(P(tmp_path / "workspaces", "test"))
+    fn = os.path.join(T.get_ms_dirname(wdir), "F1.mzML")
+    _write_test_mzml_file(fn)
+    with open(fn) as file:
+        content = file.read()
+    with open(fn, "w") as file:
+        file.write("\n" + content)
+
+    queue = T.MsFileQueue(ncpu=1)
+    queue.submit(fn, wdir)
+    queue.wait()
+
+    assert queue.errors == {}
+    assert T.get_ms_fns(wdir) == [fn.replace(".mzML", ".feather")]
+    catalog = T.get_ms_catalog(wdir)
+    assert catalog.ms_file.to_list() == ["F1.feather"]
+
+    # Failures are reported until the file is removed
+    fn_broken = os.path.join(T.get_ms_dirname(wdir), "F2.mzML")
+    with open(fn_broken, "w") as file:
+        file.write("not an mzML file")
+    queue.submit(fn_broken, wdir)
+    assert queue.status(wdir)[0] in ([fn_broken], [])
+    queue.wait()
+    pending, errors = queue.status(wdir)
+    assert pending == [] and list(errors) == [fn_broken]
+    os.remove(fn_broken)
+    assert queue.status(wdir) == ([], {})
+
+
+def test__ms_catalog(tmp_path):
+    T.create_workspace(tmp_path, "test")
+    wdir = str(P(tmp_path / "workspaces", "test"))
+    fns = [os.path.join(T.get_ms_dirname(wdir), f"F{i}.feather") for i in range(2)]
+    dfs = [_write_test_ms_file(fn, seed=i) for i, fn in enumerate(fns)]
+
+    # New files are cataloged in the background
+    catalog = T.get_ms_catalog(wdir, traces=True)
+    assert catalog.ms_file_label.to_list() == ["F0", "F1"]
+    T.wait_for_ms_catalog(wdir)
+    catalog = T.get_ms_catalog(wdir, traces=True)
+
+    assert catalog.ms_file_label.to_list() == ["F0", "F1"]
+    for (_, entry), df in zip(catalog.iterrows(), dfs):
+        assert entry.n_scans == df.scan_id.nunique()
+        assert entry.n_points == len(df)
+        assert entry.file_size == os.path.getsize(fns[int(entry.ms_file_label[1])])
+        assert entry.mz_max == df.mz.max()
+        assert entry.polarities == "+"
+        tic = df.groupby("scan_time").intensity.sum()
+        bpc = df.groupby("scan_time").intensity.max()
+        np.testing.assert_array_equal(entry.tic_scan_time, tic.index)
+        np.testing.assert_array_equal(entry.tic, tic.values)
+        np.testing.assert_array_equal(entry.bpc, bpc.values)
+
+    # Changed and deleted files are picked up
+    _write_test_ms_file(fns[0], n_scans=10)
+    os.remove(fns[1])
+    # Raw files are left to the upload queue
+    _write_test_mzml_file(os.path.join(T.get_ms_dirname(wdir), "F2.mzML"))
+    assert T.get_ms_catalog(wdir).ms_file_label.to_list() == ["F0", "F2"]
+    T.wait_for_ms_catalog(wdir)
+    catalog = T.get_ms_catalog(wdir)
+    assert catalog.n_scans.isna().to_list() == [False, True]
+    os.remove(os.path.join(T.get_ms_dirname(wdir), "F2.mzML"))
+    catalog = T.get_ms_catalog(wdir)
+    assert catalog.ms_file_label.to_list() == ["F0"]
+    assert catalog.n_scans.to_list() == [10]
+
+    targets = pd.DataFrame(
+        {"peak_label": ["A", "B"], "mz_mean": [150.0, 900.0], "rt_min": [0, 0], "rt_max": [1, 1]}
+    )
+    assert T.check_targets_against_ms_catalog(targets, wdir) == [
+        "B: m/z 900.0 outside the m/z range of the MS files "
+        f"({catalog.mz_min[0]:.4f}-{catalog.mz_max[0]:.4f})."
+    ]
+
+
+def test__ms_catalog_legacy_and_unreadable_files(tmp_path, monkeypatch):
+    T.create_workspace(tmp_path, "test")
+    wdir = str(P(tmp_path / "workspaces", "test"))
+    ms_dir = T.get_ms_dirname(wdir)
+    df = _write_test_ms_file(io.BytesIO(), n_scans=10)
+    df[["scan_time", "mz", "intensity"]].rename(
+        columns={"scan_time": "retentionTime", "mz": "m/z array", "intensity": "intensity array"}
+    ).to_feather(os.path.join(ms_dir, "legacy.feather"))
+    with open(os.path.join(ms_dir, "broken.feather"), "w") as file:
+        file.write("not a feather file")
+
+    # A failed update is retried on the next call
+    update_ms_catalog = T.update_ms_catalog
+    monkeypatch.setattr(T, "update_ms_catalog", lambda wdir: 1 / 0)
+    T.get_ms_catalog(wdir)
+    T.wait_for_ms_catalog(wdir)
+    monkeypatch.setattr(T, "update_ms_catalog", update_ms_catalog)
+    T.get_ms_catalog(wdir)
+    T.wait_for_ms_catalog(wdir)
+
+    catalog = T.get_ms_catalog(wdir).set_index("ms_file_label")
+    assert catalog.loc["legacy", "n_points"] == len(df)
+    assert catalog.loc["legacy", "mz_max"] == df.mz.max()
+    assert catalog.loc["legacy", "ms_levels"] == "1"
+    assert catalog.loc["legacy", "polarities"] == ""
+    assert pd.isna(catalog.loc["legacy", "error"])
+    assert pd.isna(catalog.loc["broken", "n_points"])
+    assert catalog.loc["broken", "error"].startswith("ArrowInvalid")
+    assert catalog.loc["broken", "content_hash"] == T.hash_file(os.path.join(ms_dir, "broken.feather"))
+
+
+def test__import_from_local_path_links_duplicates(tmp_path):
+    T.create_workspace(tmp_path, "test")
+    wdir = str(P(tmp_path / "workspaces", "test"))
+    ms_dir = T.get_ms_dirname(wdir)
+    source = tmp_path / "source"
+    os.makedirs(source / "sub")
+    _write_test_mzml_file(source / "A.mzML", n_scans=10)
+    _write_test_mzml_file(source / "sub" / "B.mzML", n_scans=10)
+    _write_test_mzml_file(source / "C.mzML", n_scans=12)
+    with open(source / "E.mzML", "w") as file:
+        file.write("not an mzML file")
+
+    imported, errors = T.import_from_local_path(str(source), ms_dir)
+
+    assert sorted(os.path.basename(fn) for fn in imported) == ["A.feather", "B.feather", "C.feather"]
+    assert list(errors) == [str(source / "E.mzML")]
+
+    assert sorted(os.listdir(ms_dir)) == ["A.feather", "B.feather", "C.feather"]
+    assert os.path.samefile(os.path.join(ms_dir, "A.feather"), os.path.join(ms_dir, "B.feather"))
+    catalog = T.get_ms_catalog(wdir).set_index("ms_file_label")
+    assert catalog.loc["A", "source_hash"] == T.hash_file(source / "A.mzML")
+    assert catalog.loc["B", "content_hash"] == catalog.loc["A", "content_hash"]
+    assert catalog.loc["C", "content_hash"] != catalog.loc["A", "content_hash"]
+
+    # A re-upload under a new name is linked as well
+    fn = os.path.join(ms_dir, "D.mzML")
+    _write_test_mzml_file(fn, n_scans=12)
+    assert T.prepare_ms_file(fn, wdir) == os.path.join(ms_dir, "D.feather")
+    assert os.path.samefile(os.path.join(ms_dir, "C.feather"), os.path.join(ms_dir, "D.feather"))
+    assert not os.path.isfile(fn)
+    assert T.get_ms_catalog(wdir).ms_file_label.to_list() == ["A", "B", "C", "D"]
+
+    # A re-upload over an existing name replaces the file and its chromatograms
+    fn_store = T.get_chromatogram_store_fn(os.path.join(ms_dir, "D.feather"), wdir)
+    T.write_chromatograms(fn_store, {"100.0-10.0": pd.DataFrame({"scan_time": [1.0], "intensity": [2.0]})})
+    assert os.path.isfile(fn_store)
+    _write_test_mzml_file(fn, n_scans=10)
+    T.prepare_ms_file(fn, wdir)
+    fn_d = os.path.join(ms_dir, "D.feather")
+    assert os.path.samefile(os.path.join(ms_dir, "A.feather"), fn_d)
+    assert not os.path.isfile(fn_store)
+    assert not os.path.isfile(fn)
+    catalog = T.get_ms_catalog(wdir).set_index("ms_file_label")
+    assert catalog.loc["D", "content_hash"] == catalog.loc["A", "content_hash"]
+    assert catalog.loc["D", "file_size"] == os.path.getsize(fn_d)
+
+
+class _RangeRequestHandler(SimpleHTTPRequestHandler):
+    # SimpleHTTPRequestHandler does not support range requests
+    range_starts = []
+
+    def send_head(self):
+        self.range_start = 0
+        header = self.headers.get("Range")
+        path = self.translate_path(self.path)
+        if header is None or not os.path.isfile(path):
+            return super().send_head()
+        self.range_start = int(header.split("=")[1].split("-")[0])
+        self.range_starts.append(self.range_start)
+        size = os.path.getsize(path)
+        file = open(path, "rb")
+        file.seek(self.range_start)
+        self.send_response(206)
+        self.send_header("Content-Length", str(size - self.range_start))
+        self.send_header("Content-Range", f"bytes {self.range_start}-{size - 1}/{size}")
+        self.end_headers()
+        return file
+
+    def log_message(self, *args):
+        pass
+
+
+def test__import_from_url(tmp_path):
+    served = tmp_path / "served"
+    os.makedirs(served)
+    for name, n_scans in [("A.mzML", 10), ("B.mzML", 12), ("C.mzML", 14)]:
+        _write_test_mzml_file(served / name, n_scans=n_scans)
+    with open(served / "notes.txt", "w") as file:
+        file.write("not an MS file")
+    handler = functools.partial(_RangeRequestHandler, directory=str(served))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    T.create_workspace(tmp_path, "test")
+    wdir = str(P(tmp_path / "workspaces", "test"))
+    ms_dir = T.get_ms_dirname(wdir)
+    # Interrupted download of A is resumed
+    content = (served / "A.mzML").read_bytes()
+    with open(os.path.join(ms_dir, "A.mzML.part"), "wb") as file:
+        file.write(content[:1000])
+    sha256 = hashlib.sha256((served / "B.mzML").read_bytes()).hexdigest()
+    progress = []
+    try:
+        assert sorted(T.get_filenames_from_url(url)) == ["A.mzML", "B.mzML", "C.mzML", "notes.txt"]
+        imported, errors = T.import_from_url(
+            url,
+            wdir,
+            max_connections=2,
+            ncpu=2,
+            hashes={"B.mzML": f"sha256:{sha256}", "C.mzML": "sha256:0"},
+            progress_callback=progress.append,
+        )
+    finally:
+        server.shutdown()
+
+    assert imported == {url + "A.mzML": os.path.join(ms_dir, "A.feather"), url + "B.mzML": os.path.join(ms_dir, "B.feather")}
+    assert list(errors) == [url + "C.mzML"]
+    assert _RangeRequestHandler.range_starts == [1000]
+    assert progress[-1] == 100
+    assert sorted(os.listdir(ms_dir)) == ["A.feather", "B.feather"]
+    pd.testing.assert_frame_equal(
+        pd.read_feather(os.path.join(ms_dir, "A.feather")), ms_file_to_df(served / "A.mzML")
+    )
+
+
+def test__import_from_url_resolves_links(tmp_path):
+    served = tmp_path / "served"
+    os.makedirs(served / "listing")
+    os.makedirs(served / "sub")
+    _write_test_mzml_file(served / "sub" / "D #1.mzML", n_scans=10)
+    with open(served / "listing" / "index.html", "w") as file:
+        file.write('<a href="../sub/D%20%231.mzML">D #1.mzML</a> <a href="../missing.mzML">missing</a>')
+    handler = functools.partial(_RangeRequestHandler, directory=str(served))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/"
+
+    T.create_workspace(tmp_path, "test")
+    wdir = str(P(tmp_path / "workspaces", "test"))
+    ms_dir = T.get_ms_dirname(wdir)
+    try:
+        with pytest.raises(IOError):
+            T.get_filenames_from_url(base_url + "nothing/")
+        # Links are relative to the listing after the redirect to 'listing/'
+        imported, errors = T.import_from_url(base_url + "listing", wdir, ncpu=1)
+    finally:
+        server.shutdown()
+
+    assert imported == {base_url + "sub/D%20%231.mzML": os.path.join(ms_dir, "D #1.feather")}
+    assert list(errors) == [base_url + "missing.mzML"]
+
+
+def test__ms_file_index(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "sub")
+    for fn in ["A.feather", "sub/B.mzML", "notes.txt", ".hidden.mzML"]:
+        (tmp_path / fn).write_text("")
+    index = T.MsFileIndex(str(tmp_path), racy_seconds=0)
+
+    assert index.refresh().fns == [str(tmp_path / "A.feather"), str(tmp_path / "sub" / "B.mzML")]
+    assert index.labels["B"] == str(tmp_path / "sub" / "B.mzML")
+
+    # Unchanged directories are not scanned again
+    n_scans = []
+    scan = index._scan
+    monkeypatch.setattr(index, "_scan", lambda: n_scans.append(1) or scan())
+    index.refresh()
+    assert n_scans == []
+
+    (tmp_path / "sub" / "C.feather").write_text("")
+    os.utime(tmp_path / "sub", ns=(0, 1))
+    assert "C" in index.refresh().labels
+    assert n_scans == [1]
+
+    # Recently modified directories are rescanned on every lookup
+    index = T.MsFileIndex(str(tmp_path), racy_seconds=3600)
+    index.refresh()
+    monkeypatch.setattr(index, "_scan", lambda: n_scans.append(1))
+    index.refresh()
+    assert n_scans == [1, 1]
+
+
+def test__get_metadata_is_cached(tmp_path, monkeypatch):
+    T.create_workspace(tmp_path, "test")
+    wdir = P(tmp_path / "workspaces", "test")
+    open(wdir / "ms_files" / "F1.mzXML", "w").close()
+    reads = []
+    read_metadata = T._read_metadata
+    monkeypatch.setattr(T, "_read_metadata", lambda *args: reads.append(1) or read_metadata(*args))
+
+    metadata = T.get_metadata(wdir)
+    metadata_before = metadata.sample_type.to_list()
+    metadata["sample_type"] = "changed by caller"
+    assert T.get_metadata(wdir).sample_type.to_list() == metadata_before
+    assert len(reads) == 1
+
+    metadata["sample_type"] = "Sample"
+    T.write_metadata(metadata, wdir)
+    assert T.get_metadata(wdir).sample_type.to_list() == ["Sample"]
+    assert len(reads) == 2
+
+    open(wdir / "ms_files" / "F2.mzXML", "w").close()
+    assert T.get_metadata(wdir).ms_file_label.to_list() == ["F1", "F2"]
+    assert len(reads) == 3
+
+
+def test__metadata_change_log(tmp_path, monkeypatch):
+    T.create_workspace(tmp_path, "test")
+    wdir = P(tmp_path / "workspaces", "test")
+    for label in ["F1", "F2"]:
+        open(wdir / "ms_files" / f"{label}.mzXML", "w").close()
+    T.write_metadata(T.get_metadata(wdir), wdir)
+    csv = open(T.get_metadata_fn(wdir)).read()
+
+    T.update_metadata(wdir, [{"op": "set", "ms_file_label": "F2", "column": "sample_type", "value": "Blank"}])
+    T.update_metadata(wdir, [{"op": "create_column", "column": "batch"}])
+    T.update_metadata(wdir, [{"op": "set", "ms_file_label": "F1", "column": "batch", "value": np.int64(3)}])
+    T.update_metadata(wdir, [{"op": "set", "ms_file_label": "F1", "column": "use_for_optimization", "value": True}])
+
+    # The table is not rewritten on edits
+    assert open(T.get_metadata_fn(wdir)).read() == csv
+    metadata = T.get_metadata(wdir).set_index("ms_file_label")
+    assert metadata.sample_type.to_list() == ["Unknown", "Blank"]
+    assert metadata.batch.to_list() == [3, ""]
+    assert metadata.use_for_optimization.to_list() == [True, False]
+
+    T.update_metadata(wdir, [{"op": "delete_column", "column": "batch"}])
+    T.compact_metadata(wdir)
+    assert not os.path.isfile(T.get_metadata_changes_fn(wdir))
+    compacted = pd.read_csv(T.get_metadata_fn(wdir)).set_index("ms_file_label")
+    assert "batch" not in compacted.columns
+    assert compacted.sample_type.to_list() == ["Unknown", "Blank"]
+    assert compacted.use_for_optimization.to_list() == [True, False]
+
+    # The log is compacted automatically
+    monkeypatch.setattr(T, "METADATA_COMPACT_EVERY", 2)
+    T.update_metadata(wdir, [{"op": "set", "ms_file_label": "F1", "column": "label", "value": "a"}])
+    assert os.path.isfile(T.get_metadata_changes_fn(wdir))
+    T.update_metadata(wdir, [{"op": "set", "ms_file_label": "F2", "column": "label", "value": "b"}])
+    assert not os.path.isfile(T.get_metadata_changes_fn(wdir))
+    assert T.get_metadata(wdir).label.to_list() == ["a", "b"]
+
+    # Changes logged by other processes are counted as well
+    with open(T.get_metadata_changes_fn(wdir), "a") as file:
+        file.write(json.dumps({"op": "set", "ms_file_label": "F1", "column": "label", "value": "c"}) + "\n")
+    T.update_metadata(wdir, [{"op": "set", "ms_file_label": "F2", "column": "label", "value": "d"}])
+    assert not os.path.isfile(T.get_metadata_changes_fn(wdir))
+    assert T.get_metadata(wdir).label.to_list() == ["c", "d"]
+
+
+def test__workspace_db(tmp_path):
+    T.create_workspace(tmp_path, "test")
+    wdir = P(tmp_path / "workspaces", "test")
+    for label in ["F1", "F2"]:
+        open(wdir / "ms_files" / f"{label}.mzXML", "w").close()
+    targets = pd.DataFrame(
+        {"peak_label": ["A", "B"], "mz_mean": [100.0, 200.0], "mz_width": [10, 10],
+         "rt_min": [1.0, None], "rt_max": [2.0, None]}
+    )
+    T.write_targets(targets, wdir)
+    expected = T.read_targets(T.get_targets_fn(wdir)).set_index("peak_label")
+
+    # Parsed once, then served from the database
+    pd.testing.assert_frame_equal(T.get_targets(wdir), expected)
+    pd.testing.assert_frame_equal(T.get_targets(wdir), expected)
+    pd.testing.assert_frame_equal(T.get_targets(wdir, peak_labels=["B"]), expected.loc[["B"]])
+
+    metadata = T.get_metadata(wdir)
+    T._METADATA_CACHE.clear()
+    pd.testing.assert_frame_equal(T.get_metadata(wdir), metadata)
+
+    with T.workspace_db(wdir) as con:
+        assert con.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        indexes = {x[0] for x in con.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {"targets_peak_label", "metadata_ms_file_label"} <= indexes
+        # Readers are not blocked by a pending write
+        con.execute("BEGIN IMMEDIATE")
+        con.execute("DELETE FROM targets")
+        pd.testing.assert_frame_equal(T.get_targets(wdir), expected)
+        con.execute("ROLLBACK")
+
+
+def test__results_store(tmp_path):
+    wdir = str(tmp_path)
+    results = pd.DataFrame(
+        {
+            "ms_file": ["/data/F1.mzXML", "/data/F1.mzXML", "/data/F2.mzXML", "/data/F2.mzXML"],
+            "peak_label": ["A", "B", "A", "B"],
+            "peak_max": [1.0, 2.0, 3.0, 4.0],
+            "peak_shape_rt": ["1,2", "1,2", "1,2", "1,2"],
+        }
+    )
+    # Results of older versions are converted on first access
+    os.makedirs(tmp_path / "results")
+    results.to_csv(T.get_results_csv_fn(wdir), index=False)
+    assert T.export_results_csv(wdir) == T.get_results_csv_fn(wdir)
+    stored = T.get_results(wdir)
+    assert stored.ms_file_label.to_list() == ["F1", "F1", "F2", "F2"]
+
+    schema = pq.read_schema(T.get_results_fn(wdir))
+    assert pa.types.is_dictionary(schema.field("peak_label").type)
+    assert pa.types.is_dictionary(schema.field("ms_file_label").type)
+    pd.testing.assert_frame_equal(stored.drop(columns="ms_file_label"), results)
+
+    subset = T.get_results(wdir, columns=["ms_file_label", "peak_max"], peak_labels=["B"])
+    assert subset.columns.to_list() == ["ms_file_label", "peak_max"]
+    assert subset.peak_max.to_list() == [2.0, 4.0]
+    assert subset.ms_file_label.dtype == object
+
+    T.write_results(results.iloc[:2], wdir)
+    pd.testing.assert_frame_equal(
+        pd.read_csv(T.export_results_csv(wdir)), T.get_results(wdir)
+    )
+    T.delete_results(wdir)
+    assert not os.path.isfile(T.get_results_fn(wdir))
+    assert not os.path.isfile(T.get_results_csv_fn(wdir))
+
+
+def test__run_mint_is_incremental(tmp_path):
+    wdir = str(tmp_path)
+    fns = [str(tmp_path / f"F{i}.feather") for i in range(3)]
+    for i, fn in enumerate(fns):
+        _write_test_ms_file(fn, seed=i)
+    targets = pd.DataFrame(
+        {"peak_label": ["A", "B"], "mz_mean": [150.0, 300.0], "mz_width": [10000, 5000],
+         "rt_min": [10.0, 20.0], "rt_max": [30.0, 40.0]}
+    )
+    targets = T.standardize_targets(targets).set_index("peak_label")
+
+    summary = T.run_mint(wdir, targets, fns[:2], nthreads=1)
+    assert summary["computed"]["results"] == 4
+    summary = T.run_mint(wdir, targets, fns[:2], nthreads=1)
+    assert summary["computed"]["results"] == 0
+    assert summary["reused"]["results"] == 4
+
+    targets.loc["B", "rt_max"] = 50.0
+    summary = T.run_mint(wdir, targets, fns, nthreads=1)
+    # The new file with both targets and target B for the other files
+    assert summary["computed"] == {"ms_files": 1, "targets": 1, "results": 4}
+    assert summary["reused"] == {"ms_files": 2, "targets": 1, "results": 2}
+
+    # Changes of the content are detected even if size and mtime are kept
+    stat = os.stat(fns[0])
+    with open(fns[0], "r+b") as file:
+        file.seek(stat.st_size // 2)
+        byte = file.read(1)
+        file.seek(stat.st_size // 2)
+        file.write(bytes([byte[0] ^ 1]))
+    os.utime(fns[0], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    hashes = T.get_ms_file_content_hashes(wdir, fns)
+    assert hashes[fns[0]] != T.read_results_fingerprints(wdir)["ms_files"][fns[0]]
+    assert hashes[fns[1]] == T.read_results_fingerprints(wdir)["ms_files"][fns[1]]
+    with open(fns[0], "r+b") as file:
+        file.seek(stat.st_size // 2)
+        file.write(byte)
+
+    incremental = T.get_results(wdir)
+    T.delete_results(wdir)
+    T.run_mint(wdir, targets, fns, nthreads=1)
+    complete = T.get_results(wdir)
+    columns = ["ms_file", "peak_label", "rt_max", "peak_area", "peak_max"]
+    pd.testing.assert_frame_equal(incremental[columns], complete[columns])
+
+
+def test__cached_ms_file_reader():
+    import ms_mint.TargetOptimizer
+
+    original = ms_mint.TargetOptimizer.ms_file_to_df
+    with T.cached_ms_file_reader():
+        assert ms_mint.TargetOptimizer.ms_file_to_df is T.read_ms_file
+    assert ms_mint.TargetOptimizer.ms_file_to_df is original